@@ -1,20 +1,28 @@
-import requests, json, subprocess, os, math, random, uuid, io, time, shutil, sys
+import requests, json, subprocess, os, math, random, uuid, time, shutil, sys, tempfile, threading, atexit, hashlib, fcntl, queue
 
 import cv2
 import numpy as np
+import redis
 
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timedelta
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait as waitForFutures
 from dotenv import load_dotenv
 
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
-from googleapiclient.http import MediaIoBaseDownload
 
-from flask import Flask, request, jsonify, send_file, after_this_request, make_response
-from celery import Celery
+from flask import Flask, request, jsonify, send_file, make_response, Response
+from celery import Celery, chord, group
 from celery.result import AsyncResult
+from celery.signals import worker_init, worker_process_shutdown, before_task_publish, task_prerun, task_success, task_failure, task_retry
+from billiard import Pool
 
 app = Flask(__name__)
 
@@ -30,11 +38,54 @@ AIRTABLE_LONG_FORMAT_TABLE_ID = os.getenv("AIRTABLE_LONG_FORMAT_TABLE_ID")
 AIRTABLE_LONG_FORMAT_VIEW_ID = os.getenv("AIRTABLE_LONG_FORMAT_VIEW_ID")
 AIRTABLE_SHORT_FORMAT_TABLE_ID = os.getenv("AIRTABLE_SHORT_FORMAT_TABLE_ID")
 SPLIT_VIDEO_LENGTH = os.getenv("SPLIT_VIDEO_LENGTH")
+AIRTABLE_API_URL = os.getenv("AIRTABLE_API_URL", "https://api.airtable.com/v0") # Point at a local stand-in server for tests
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", 5)) # Requests per second per base, shared by every process through Redis
+AIRTABLE_MAX_RETRIES = int(os.getenv("AIRTABLE_MAX_RETRIES", 5))
+AIRTABLE_MAX_BACKOFF = float(os.getenv("AIRTABLE_MAX_BACKOFF", 30)) # Seconds
+AIRTABLE_TIMEOUT = float(os.getenv("AIRTABLE_TIMEOUT", 30)) # Seconds
+AIRTABLE_BATCH_SIZE = 10 # Records per create or update request allowed by Airtable
+AIRTABLE_FLUSH_INTERVAL = float(os.getenv("AIRTABLE_FLUSH_INTERVAL", 10)) # Seconds buffered status updates wait for a full batch
 USER_ACCOUNT_EMAIL = os.getenv("USER_ACCOUNT_EMAIL")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0") # Celery broker, result backend and metrics store
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true" # Record stage metrics in Redis
+PIXEL_ENGINE = os.getenv("PIXEL_ENGINE", "numpy") # "numpy" (batched) or "python" (per pixel loop)
+STREAM_FRAMES = os.getenv("STREAM_FRAMES", "true").lower() == "true" # Pipe processed frames straight into the final encode
+PIXEL_EFFECT_MODE = os.getenv("PIXEL_EFFECT_MODE", "frames") # "frames" (OpenCV and NumPy) or "ffmpeg" (filters in the encode pass)
+
+# Workers consuming the transcode queue run a few CPU heavy jobs that share the cores through ffmpeg threads, workers
+# consuming the transfer queue mostly wait on the network and run many jobs at once. The interactive queue keeps a
+# worker free for /processSingleVideo so bulk batches never delay it
+CPU_COUNT = os.cpu_count() or 1
+WORKER_ROLE = os.getenv("WORKER_ROLE") # "transcode", "transfer", "interactive" or unset for a worker consuming every queue
+workerConcurrencyDefaults = {"transcode": max(1, CPU_COUNT // 4), "transfer": CPU_COUNT * 4, "interactive": 1}
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", workerConcurrencyDefaults.get(WORKER_ROLE, 1)))
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", max(1, CPU_COUNT // WORKER_CONCURRENCY))) # Thread budget of one task's ffmpeg encodes
+VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", max(1, CPU_COUNT // WORKER_CONCURRENCY))) # Processes rendering the variants of one video
+FRAME_WORKERS = int(os.getenv("FRAME_WORKERS", FFMPEG_THREADS)) # Threads transforming the frames of one video
+ENCODE_CHUNKS = int(os.getenv("ENCODE_CHUNKS", 1)) # FFmpeg processes encoding keyframe aligned chunks of one variant, 1 encodes in one pass
+ENCODE_CHUNK_MIN_SECONDS = float(os.getenv("ENCODE_CHUNK_MIN_SECONDS", 10)) # Shortest chunk worth its own encoder
+VARIANT_DISPATCH = os.getenv("VARIANT_DISPATCH", "local") # "local" renders all variants in processVideoTask, "chord" runs one Celery task per variant
+
+DRIVE_HTTP_TIMEOUT = int(os.getenv("DRIVE_HTTP_TIMEOUT", 300)) # Seconds
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4)) # Concurrent background Drive uploads per task
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", 8)) # Finished files waiting for upload before encoding blocks
+DRIVE_DOWNLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_DOWNLOAD_CHUNK_SIZE", 32 * 1024 * 1024)) # Bytes held in memory per download
+DRIVE_DOWNLOAD_RETRIES = int(os.getenv("DRIVE_DOWNLOAD_RETRIES", 5)) # Consecutive failed chunks before a download gives up
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", "SourceCache") # Downloaded sources shared by the workers of a host
+SOURCE_CACHE_MAX_BYTES = int(os.getenv("SOURCE_CACHE_MAX_BYTES", 20 * 1024 ** 3)) # 0 disables the cache
+BATCH_TTL_SECONDS = int(os.getenv("BATCH_TTL_SECONDS", 7 * 24 * 3600)) # How long batch counters stay available to /batches
+CHECKPOINT_TTL_SECONDS = int(os.getenv("CHECKPOINT_TTL_SECONDS", 2 * 24 * 3600)) # How long a record's finished steps are kept for retries
+TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", 3)) # Automatic retries of a failed video processing task
+TASK_RETRY_BACKOFF_MAX = int(os.getenv("TASK_RETRY_BACKOFF_MAX", 600)) # Longest wait in seconds between retries
+RESULT_TTL_SECONDS = int(os.getenv("RESULT_TTL_SECONDS", 24 * 3600)) # How long /processSingleVideo results stay downloadable
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 2)) # Seconds between progress updates a task writes to the result backend
+SPLIT_MODE = os.getenv("SPLIT_MODE", "segment") # "segment" (one pass, keyframe cuts), "accurate" (one pass, exact lengths) or "seek" (one ffmpeg per clip)
 
 # GOOGLE_DRIVE_FOLDER_ID = os.getenv("GOOGLE_DRIVE_FOLDER_ID")
 
-baseUrl = "https://api.airtable.com/v0"
+SERVICE_ACCOUNT_FILE = "creds.json"
+
+baseUrl = AIRTABLE_API_URL
 driveDownloadBaseUrl = "https://drive.google.com/uc?export=download&id="
 
 locations = {
@@ -50,6 +101,63 @@ locations = {
     "San Jose": "+37.3382-121.8863/",
 }
 
+# Metrics aggregated in Redis across web and worker processes, served by /metrics
+redisClient = None
+METRICS_KEY_PREFIX = "metrics"
+METRICS_NAME_PREFIX = "video_processing"
+BATCH_KEY_PREFIX = "batch"
+CHECKPOINT_KEY_PREFIX = "checkpoint"
+RATE_LIMIT_KEY_PREFIX = "ratelimit"
+metricsInfo = {
+    "stage_duration_seconds": ("histogram", "Duration of processing stages"),
+    "queue_wait_seconds": ("histogram", "Time tasks waited in the broker before a worker started them"),
+    "bytes_total": ("counter", "Bytes moved to and from Google Drive and source URLs"),
+    "frames_processed_total": ("counter", "Video frames run through the OpenCV stages"),
+    "airtable_requests_total": ("counter", "Airtable requests by response status"),
+    "airtable_throttled_seconds_total": ("counter", "Seconds spent waiting for the Airtable rate limit or backing off"),
+    "cache_requests_total": ("counter", "Drive client and source cache lookups"),
+    "source_cache_saved_bytes_total": ("counter", "Download bytes served from the source cache"),
+}
+metricsBuckets = {
+    "stage_duration_seconds": (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+    "queue_wait_seconds": (0.1, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200),
+}
+
+# Airtable session and rate limiters shared by the helpers, see airtableRequest
+airtableSession = None
+airtableSessionPid = None
+airtableBuckets = {}
+statusUpdateBuffers = {}
+
+# Upload threads shared by the tasks of a worker process, so their cached Drive clients outlive a task
+uploadExecutor = None
+uploadExecutorPid = None
+uploadExecutorLock = threading.Lock()
+statusUpdateBuffersLock = threading.Lock()
+
+# Probe results, see probeMedia. Width and height are display dimensions, duration is in seconds, bitrate in bits/s,
+# keyframes holds keyframe timestamps once they were requested
+MediaInfo = namedtuple("MediaInfo", ["width", "height", "fps", "duration", "bitrate", "hasAudio", "keyframes"])
+mediaInfoCache = {}
+mediaInfoCacheLock = threading.Lock()
+MEDIA_INFO_CACHE_SIZE = 256
+
+# Hit and miss counters of the source cache in this worker process, see getCachedSource
+sourceCacheStats = {"hits": 0, "misses": 0, "bytesSaved": 0}
+sourceCacheStatsLock = threading.Lock()
+
+# Drive clients cached per worker process and thread, see getDriveService
+driveServices = threading.local()
+driveServiceStats = {"hits": 0, "misses": 0}
+driveServiceStatsLock = threading.Lock()
+
+# 3x3 neighbourhood offsets and the weighted average kernel, flattened row by row
+neighbourOffsetsY, neighbourOffsetsX = (offsets.ravel() for offsets in np.mgrid[-1:2, -1:2])
+weightedKernel = np.array([1, 2, 1, 2, 4, 2, 1, 2, 1])
+
+# Turned off in the variant pool processes, they inherit the task of the parent but don't own its state
+progressEnabled = True
+
 def make_celery(app):
     celery = Celery(
         app.import_name,
@@ -60,16 +168,506 @@ def make_celery(app):
     return celery
 
 app.config.update(
-    CELERY_BROKER_URL='redis://redis:6379/0',
-    result_backend='redis://redis:6379/0'
+    CELERY_BROKER_URL=REDIS_URL,
+    result_backend=REDIS_URL
 )
 
 celery = make_celery(app)
 
-def getAirtableRecords(offset, tableId, viewId, filterColumns):
-    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{tableId}"
-    headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}"}
+celery.conf.update(
+    task_routes={
+        "app.processVideoTask": {"queue": "transcode"},
+        "app.processVariantTask": {"queue": "transcode"},
+        "app.downloadSingleVideo": {"queue": "interactive"},
+        "app.saveVariantsTask": {"queue": "transfer"},
+        "app.processLongVideos": {"queue": "transfer"},
+        "app.enqueueProcessingBatch": {"queue": "transfer"},
+        "app.enqueueSplitBatch": {"queue": "transfer"},
+    },
+    task_default_queue="transfer",
+    # Tasks run for minutes, a process reserving more than the next one would hold them back from idle workers
+    worker_prefetch_multiplier=1,
+)
+if WORKER_ROLE is not None or "WORKER_CONCURRENCY" in os.environ:
+    celery.conf.worker_concurrency = WORKER_CONCURRENCY
+
+
+@worker_init.connect
+def sizeWorkerBudgets(sender=None, **kwargs):
+    # -c or Celery's own default of one process per core can leave the worker running with another concurrency than
+    # WORKER_CONCURRENCY. The thread and process budgets are sized again from the real one before the pool forks,
+    # values set explicitly in the environment are kept
+    global WORKER_CONCURRENCY, FFMPEG_THREADS, VARIANT_WORKERS, FRAME_WORKERS
+    concurrency = getattr(sender, "concurrency", None)
+    if not concurrency or concurrency == WORKER_CONCURRENCY:
+        return
+    WORKER_CONCURRENCY = concurrency
+    FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", max(1, CPU_COUNT // concurrency)))
+    VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", max(1, CPU_COUNT // concurrency)))
+    FRAME_WORKERS = int(os.getenv("FRAME_WORKERS", FFMPEG_THREADS))
+    print(f"Worker concurrency {concurrency}: {FFMPEG_THREADS} ffmpeg threads, {VARIANT_WORKERS} variant workers, {FRAME_WORKERS} frame workers per task")
+
+
+def getRedisClient():
+    global redisClient
+    if redisClient is None:
+        redisClient = redis.Redis.from_url(REDIS_URL, socket_timeout=5)
+    return redisClient
+
+
+def getMetricLabels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in sorted((labels or {}).items()))
+
+
+def formatMetricLabels(labelString):
+    return f"{{{labelString}}}" if labelString else ""
+
+
+def incrementMetric(name, value=1, labels=None):
+    # Metrics live in Redis so every web and worker process adds to the same series. They must never break a task,
+    # so Redis errors are only logged
+    if not METRICS_ENABLED:
+        return
+    try:
+        getRedisClient().hincrbyfloat(f"{METRICS_KEY_PREFIX}:{name}", getMetricLabels(labels), value)
+    except redis.exceptions.RedisError as e:
+        print(f"Could not record metric {name}: {e}")
+
+
+def observeMetric(name, value, labels=None):
+    if not METRICS_ENABLED:
+        return
+    labelString = getMetricLabels(labels)
+    try:
+        pipeline = getRedisClient().pipeline(transaction=False)
+        key = f"{METRICS_KEY_PREFIX}:{name}"
+        for bucket in metricsBuckets[name]:
+            if value <= bucket:
+                pipeline.hincrby(key, f"{labelString}|bucket|{bucket}", 1)
+        pipeline.hincrbyfloat(key, f"{labelString}|sum", value)
+        pipeline.hincrby(key, f"{labelString}|count", 1)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        print(f"Could not record metric {name}: {e}")
+
+
+@contextmanager
+def timedStage(stage):
+    startTime = time.monotonic()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        observeMetric("stage_duration_seconds", time.monotonic() - startTime, {"stage": stage, "status": status})
+
+
+def renderMetrics():
+    lines = []
+    for name, (metricType, description) in metricsInfo.items():
+        values = getRedisClient().hgetall(f"{METRICS_KEY_PREFIX}:{name}")
+        fullName = f"{METRICS_NAME_PREFIX}_{name}"
+        lines.append(f"# HELP {fullName} {description}")
+        lines.append(f"# TYPE {fullName} {metricType}")
+        series = sorted((field.decode(), value.decode()) for field, value in values.items())
+
+        if metricType == "counter":
+            for labelString, value in series:
+                lines.append(f"{fullName}{formatMetricLabels(labelString)} {value}")
+            continue
+
+        # Buckets are stored cumulatively, a bucket that never got a sample is missing and reported as 0
+        histograms = {}
+        for field, value in series:
+            labelString, _, part = field.partition("|")
+            histograms.setdefault(labelString, {})[part] = value
+        for labelString, parts in histograms.items():
+            separator = "," if labelString else ""
+            for bucket in metricsBuckets[name]:
+                lines.append(f'{fullName}_bucket{{{labelString}{separator}le="{bucket}"}} {parts.get(f"bucket|{bucket}", 0)}')
+            lines.append(f'{fullName}_bucket{{{labelString}{separator}le="+Inf"}} {parts.get("count", 0)}')
+            lines.append(f"{fullName}_sum{formatMetricLabels(labelString)} {parts.get('sum', 0)}")
+            lines.append(f"{fullName}_count{formatMetricLabels(labelString)} {parts.get('count', 0)}")
+    return "\n".join(lines) + "\n"
+
+
+@before_task_publish.connect
+def markTaskEnqueued(headers=None, **kwargs):
+    if headers is not None:
+        headers["enqueuedAt"] = time.time()
+
+
+def getTaskHeader(task, name):
+    return task.request.get(name) or (task.request.headers or {}).get(name)
+
+
+@task_prerun.connect
+def observeQueueWait(task=None, **kwargs):
+    enqueuedAt = getTaskHeader(task, "enqueuedAt")
+    if enqueuedAt is not None:
+        queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+        observeMetric("queue_wait_seconds", max(0, time.time() - enqueuedAt), {"task": task.name.split(".")[-1], "queue": queue})
+
+
+# Batches started by / and /splitVideos are counted in a Redis hash. Their tasks carry the batch id as a message
+# header and the task signals move them through running, done and failed
+def getBatchKey(batchId):
+    return f"{BATCH_KEY_PREFIX}:{batchId}"
+
+
+def createBatch(batchId, kind):
+    pipeline = getRedisClient().pipeline()
+    pipeline.hset(getBatchKey(batchId), mapping={
+        "kind": kind,
+        "state": "intake",
+        "createdAt": time.time(),
+        "pages": 0,
+        "enqueued": 0,
+        "running": 0,
+        "done": 0,
+        "failed": 0,
+        "retried": 0,
+    })
+    pipeline.expire(getBatchKey(batchId), BATCH_TTL_SECONDS)
+    pipeline.execute()
+
+
+def updateBatch(batchId, counts=None, **fields):
+    # Like the metrics, batch counters must never break a task
+    try:
+        pipeline = getRedisClient().pipeline()
+        for field, value in (counts or {}).items():
+            pipeline.hincrby(getBatchKey(batchId), field, value)
+        if fields:
+            pipeline.hset(getBatchKey(batchId), mapping=fields)
+        pipeline.expire(getBatchKey(batchId), BATCH_TTL_SECONDS)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        print(f"Could not update batch {batchId}: {e}")
+
+
+def getBatch(batchId):
+    batch = {key.decode(): value.decode() for key, value in getRedisClient().hgetall(getBatchKey(batchId)).items()}
+    if not batch:
+        return None
+    for field in ("pages", "enqueued", "running", "done", "failed", "retried"):
+        batch[field] = int(batch.get(field, 0))
+    batch["createdAt"] = float(batch.get("createdAt", 0))
+    batch["batchId"] = batchId
+    return batch
+
+
+def getBatchChordHeaders(task, recordId, batchPart):
+    # A record handed to a chord finishes in its saveVariantsTask ("final"), its variant tasks ("variant") only count
+    # when they fail. The record's own task is then left out of the done count
+    batchId = getTaskHeader(task, "batchId")
+    if batchId is None:
+        return {}
+    task.request.batchHandedOff = True
+    return {"batchId": batchId, "batchPart": batchPart, "batchRecordId": recordId}
+
+
+def markBatchRecordFailed(batchId, recordId):
+    # Several parts of one chord can fail, the record is counted once
+    try:
+        if not getRedisClient().set(f"{getBatchKey(batchId)}:failed:{recordId}", 1, nx=True, ex=BATCH_TTL_SECONDS):
+            return
+    except redis.exceptions.RedisError as e:
+        print(f"Could not update batch {batchId}: {e}")
+        return
+    updateBatch(batchId, {"running": -1, "failed": 1})
+
+
+@task_prerun.connect
+def markBatchTaskRunning(task=None, **kwargs):
+    batchId = getTaskHeader(task, "batchId")
+    if batchId is not None and getTaskHeader(task, "batchPart") is None:
+        updateBatch(batchId, {"running": 1})
+
+
+@task_success.connect
+def markBatchTaskDone(sender=None, **kwargs):
+    batchId = getTaskHeader(sender, "batchId")
+    if batchId is None or getTaskHeader(sender, "batchPart") == "variant" or sender.request.get("batchHandedOff"):
+        return
+    updateBatch(batchId, {"running": -1, "done": 1})
+
+
+@task_failure.connect
+def markBatchTaskFailed(sender=None, **kwargs):
+    batchId = getTaskHeader(sender, "batchId")
+    if batchId is None:
+        return
+    if getTaskHeader(sender, "batchPart") is not None:
+        markBatchRecordFailed(batchId, getTaskHeader(sender, "batchRecordId"))
+    else:
+        updateBatch(batchId, {"running": -1, "failed": 1})
+
+
+@task_retry.connect
+def markBatchTaskRetried(sender=None, **kwargs):
+    # The retry counts as running again once a worker picks it up, chord parts never left the record's running count
+    batchId = getTaskHeader(sender, "batchId")
+    if batchId is None:
+        return
+    if getTaskHeader(sender, "batchPart") is not None:
+        updateBatch(batchId, {"retried": 1})
+    else:
+        updateBatch(batchId, {"running": -1, "retried": 1})
+
+
+# Steps a record finished (source downloaded, variant rendered, variant uploaded with its URL) are kept in a Redis
+# hash so a retried task resumes after them instead of starting over. Values are JSON
+def getCheckpointKey(recordId):
+    return f"{CHECKPOINT_KEY_PREFIX}:{recordId}"
+
+
+def getCheckpoint(recordId):
+    try:
+        checkpoint = getRedisClient().hgetall(getCheckpointKey(recordId))
+    except redis.exceptions.RedisError as e:
+        print(f"Could not read checkpoint of {recordId}: {e}")
+        return {}
+    return {step.decode(): json.loads(value) for step, value in checkpoint.items()}
+
+
+def saveCheckpoint(recordId, step, value=True):
+    # A lost checkpoint only costs repeated work on retry, so Redis errors don't fail the step that just finished
+    try:
+        pipeline = getRedisClient().pipeline()
+        pipeline.hset(getCheckpointKey(recordId), step, json.dumps(value))
+        pipeline.expire(getCheckpointKey(recordId), CHECKPOINT_TTL_SECONDS)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        print(f"Could not save checkpoint {step} of {recordId}: {e}")
+
+
+def clearCheckpoint(recordId):
+    try:
+        getRedisClient().delete(getCheckpointKey(recordId))
+    except redis.exceptions.RedisError as e:
+        print(f"Could not clear checkpoint of {recordId}: {e}")
+
+
+class ProgressReporter:
+    """Publishes how far the running Celery task is as its PROGRESS state, for the /processSingleVideo poll.
+
+    Updates are throttled to one every PROGRESS_INTERVAL seconds. Frame counts reported under different sources, like
+    the encoders of a chunked encode, are summed. Outside a task it does nothing.
+    """
+
+    def __init__(self, stage, totalFrames=None):
+        task = celery.current_task if progressEnabled else None
+        if task is not None and (task.request.id is None or task.request.called_directly or task.request.is_eager):
+            task = None
+        self.task = task
+        self.stage = stage
+        self.totalFrames = totalFrames or None
+        self.frames = {}
+        self.startTime = time.monotonic()
+        self.updatedAt = 0
+        self.lock = threading.Lock()
+
+    def update(self, frames, source=None):
+        if self.task is None:
+            return
+        with self.lock:
+            self.frames[source] = frames
+            now = time.monotonic()
+            if now - self.updatedAt < PROGRESS_INTERVAL:
+                return
+            self.updatedAt = now
+            framesDone = sum(self.frames.values())
+        elapsed = now - self.startTime
+        fps = framesDone / elapsed if elapsed > 0 else 0
+        eta = None
+        if fps > 0 and self.totalFrames is not None:
+            eta = round(max(0, self.totalFrames - framesDone) / fps, 1)
+        meta = {"stage": self.stage, "frames": framesDone, "totalFrames": self.totalFrames, "fps": round(fps, 2), "eta": eta}
+        # Progress is informational, a backend hiccup must not fail the task
+        try:
+            self.task.update_state(state="PROGRESS", meta=meta)
+        except redis.exceptions.RedisError as e:
+            print(f"Could not report progress: {e}")
+
+
+def getFrameCount(videoPath):
+    try:
+        mediaInfo = probeMedia(videoPath)
+    except (RuntimeError, ValueError, OSError):
+        return None
+    return int(round(mediaInfo.duration * mediaInfo.fps)) or None
+
+
+def runFfmpegWithProgress(ffmpegCommand, reporter, source=None):
+    # -progress prints key=value blocks on stdout about twice a second, frame is the number of frames encoded so far
+    ffmpegCommand = [ffmpegCommand[0], "-progress", "pipe:1", "-nostats", *ffmpegCommand[1:]]
+    with tempfile.TemporaryFile() as ffmpegLog:
+        process = subprocess.Popen(ffmpegCommand, stdout=subprocess.PIPE, stderr=ffmpegLog, text=True)
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "frame" and value.isdigit():
+                reporter.update(int(value), source)
+        returnCode = process.wait()
+        if returnCode != 0:
+            ffmpegLog.seek(0)
+            stderr = ffmpegLog.read().decode("utf-8", errors="replace")
+            raise subprocess.CalledProcessError(returnCode, ffmpegCommand, stderr=stderr)
+
+
+class TokenBucket:
+    """Token bucket rate limiter shared by the threads of a worker process.
+
+    Requests take one token each, tokens refill at `rate` per second up to `capacity`. pause empties the bucket for a
+    while so every thread backs off together after a 429.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updatedAt = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Returns the seconds spent waiting for a token
+        startTime = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+                self.updatedAt = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - startTime
+                waitTime = (1 - self.tokens) / self.rate
+            time.sleep(waitTime)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+            self.updatedAt = time.monotonic()
+
+
+# Token bucket kept in a Redis hash so every process calling the same API shares it. ARGV holds the rate, the capacity,
+# the caller's clock and a pause in seconds. Without a pause it takes a token and returns the seconds to wait when
+# none is left, with one it empties the bucket until the pause is over
+rateLimitScript = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updatedAt = tonumber(redis.call('HGET', KEYS[1], 'updatedAt'))
+local rate, capacity, now, pause = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+if tokens == nil then
+    tokens, updatedAt = capacity, now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updatedAt) * rate)
+updatedAt = math.max(now, updatedAt)
+local waitTime = 0
+if pause > 0 then
+    tokens = math.min(tokens, 1 - pause * rate)
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    waitTime = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updatedAt', tostring(updatedAt))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(waitTime)
+"""
+
+
+class SharedRateLimiter:
+    def __init__(self, name, rate, capacity=None):
+        self.key = f"{RATE_LIMIT_KEY_PREFIX}:{name}"
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.localBucket = TokenBucket(max(0.1, rate / WORKER_CONCURRENCY))
+
+    def runScript(self, pause=0):
+        script = getRedisClient().register_script(rateLimitScript)
+        return float(script(keys=[self.key], args=[self.rate, self.capacity, time.time(), pause]))
+
+    def acquire(self):
+        # Returns the seconds spent waiting for a token, without Redis the process limits itself to its share
+        startTime = time.monotonic()
+        while True:
+            try:
+                waitTime = self.runScript()
+            except redis.exceptions.RedisError as e:
+                print(f"Could not reach the shared rate limit {self.key}, limiting locally: {e}")
+                return time.monotonic() - startTime + self.localBucket.acquire()
+            if waitTime <= 0:
+                return time.monotonic() - startTime
+            time.sleep(waitTime)
+
+    def pause(self, seconds):
+        self.localBucket.pause(seconds)
+        try:
+            self.runScript(seconds)
+        except redis.exceptions.RedisError as e:
+            print(f"Could not pause the shared rate limit {self.key}: {e}")
+
+
+def getAirtableSession():
+    # One pooled session per worker process, sessions inherited through fork are replaced
+    global airtableSession, airtableSessionPid
+    if airtableSession is None or airtableSessionPid != os.getpid():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Authorization": f"Bearer {AIRTABLE_API_KEY}", "Content-Type": "application/json"})
+        airtableSession, airtableSessionPid = session, os.getpid()
+    return airtableSession
+
+
+def getAirtableRetryDelay(response, attempt):
+    retryAfter = response.headers.get("Retry-After") if response is not None else None
+    if retryAfter is not None:
+        try:
+            return min(float(retryAfter), AIRTABLE_MAX_BACKOFF)
+        except ValueError:
+            pass
+    return min(AIRTABLE_MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1)
+
+
+def airtableRequest(method, path, params=None, payload=None):
+    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{path}"
+    bucket = airtableBuckets.get(AIRTABLE_BASE_ID)
+    if bucket is None:
+        bucket = airtableBuckets.setdefault(AIRTABLE_BASE_ID, SharedRateLimiter(f"airtable:{AIRTABLE_BASE_ID}", AIRTABLE_RATE_LIMIT))
+    data = json.dumps(payload) if payload is not None else None
+
+    # 429s honour Retry-After when Airtable sends it, otherwise they and 5xx responses back off exponentially up to
+    # AIRTABLE_MAX_BACKOFF seconds. The response of the last attempt is raised as an HTTPError
+    for attempt in range(AIRTABLE_MAX_RETRIES + 1):
+        waitedSeconds = bucket.acquire()
+        if waitedSeconds > 0:
+            incrementMetric("airtable_throttled_seconds_total", waitedSeconds, {"reason": "rate_limit"})
+        try:
+            response = getAirtableSession().request(method, url, params=params, data=data, timeout=AIRTABLE_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            incrementMetric("airtable_requests_total", 1, {"method": method, "status": "connection_error"})
+            if attempt == AIRTABLE_MAX_RETRIES:
+                raise
+            response = None
+            print(f"Airtable {method} {path} failed: {e}")
+        else:
+            incrementMetric("airtable_requests_total", 1, {"method": method, "status": str(response.status_code)})
+            if (response.status_code != 429 and response.status_code < 500) or attempt == AIRTABLE_MAX_RETRIES:
+                break
+
+        delay = getAirtableRetryDelay(response, attempt)
+        if response is not None and response.status_code == 429: # Request rate limit case
+            bucket.pause(delay)
+        print(f"Airtable {method} {path} retry {attempt + 1}/{AIRTABLE_MAX_RETRIES} in {delay:.1f}s")
+        incrementMetric("airtable_throttled_seconds_total", delay, {"reason": "backoff"})
+        time.sleep(delay)
 
+    response.raise_for_status()
+    return response
+
+
+def getAirtableRecords(offset, tableId, viewId, filterColumns):
     # params = {"view": viewId, 'filterByFormula': "{" + filterColumnName + "} = False()"}
 
     columnNames = list(filterColumns.keys())
@@ -83,11 +681,7 @@ def getAirtableRecords(offset, tableId, viewId, filterColumns):
     print(f"Records Offset: {offset}")
 
     try:
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code == 429: # Request rate limit case
-            time.sleep(30)
-            response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
+        response = airtableRequest("GET", tableId, params=params)
 
         data = response.json()
         airtableData = {
@@ -98,7 +692,7 @@ def getAirtableRecords(offset, tableId, viewId, filterColumns):
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error: {e}")
-        print(f"Response content: {response.text}")
+        print(f"Response content: {e.response.text}")
         return {}
 
     except requests.exceptions.RequestException as e:
@@ -108,12 +702,147 @@ def getAirtableRecords(offset, tableId, viewId, filterColumns):
 
 def downloadVideo(videoUrl, folderName, recordId):
     fileName = f"{recordId}"
+    filePath = f"{folderName}/{fileName}.mp4"
+    getCachedSource(getSourceCacheKey(videoUrl), filePath, lambda downloadPath: downloadUrlToFile(videoUrl, downloadPath))
+    print(f"Video: {fileName}.mp4 downloaded")
+    return fileName
+
+
+def downloadUrlToFile(videoUrl, filePath):
+    # Written under a temporary name so concurrent tasks never read a partial download
+    partialFilePath = f"{filePath}.{uuid.uuid4().hex}.part"
     response = requests.get(url=videoUrl, stream=True)
-    with open(f"{folderName}/{fileName}.mp4", "wb") as writer:
+    response.raise_for_status()
+    with open(partialFilePath, "wb") as writer:
         for chunk in response.iter_content(chunk_size=8192):
             writer.write(chunk)
-    print(f"Video: {fileName}.mp4 downloaded")
-    return fileName
+    os.replace(partialFilePath, filePath)
+    incrementMetric("bytes_total", os.path.getsize(filePath), {"direction": "download", "target": "url"})
+
+
+def getSourceCacheKey(videoUrl):
+    # Drive links to the same file differ in their query strings, the file id identifies the source
+    fileId = parse_qs(urlparse(videoUrl).query).get("id", [None])[0]
+    return f"drive:{fileId}" if fileId else videoUrl
+
+
+def getCachedSource(cacheKey, filePath, download):
+    """Places the source identified by cacheKey at filePath, calling download(path) only on a cache miss.
+
+    Sources are stored once per content hash under SOURCE_CACHE_DIR/objects and found through SOURCE_CACHE_DIR/keys.
+    A per-key file lock lets concurrent workers on one host wait for a running download instead of repeating it,
+    entries are written through rename so they never appear half written.
+    """
+    if SOURCE_CACHE_MAX_BYTES <= 0:
+        tempPath = f"{filePath}.{uuid.uuid4().hex}.tmp"
+        try:
+            download(tempPath)
+            os.replace(tempPath, filePath)
+        finally:
+            removeFile(tempPath)
+        return
+
+    for folderName in ("objects", "keys", "locks", "tmp"):
+        os.makedirs(os.path.join(SOURCE_CACHE_DIR, folderName), exist_ok=True)
+    keyHash = hashlib.sha256(cacheKey.encode("utf-8")).hexdigest()
+    keyPath = os.path.join(SOURCE_CACHE_DIR, "keys", keyHash)
+
+    with open(os.path.join(SOURCE_CACHE_DIR, "locks", keyHash), "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        objectPath = None
+        if os.path.exists(keyPath):
+            with open(keyPath) as reader:
+                objectPath = os.path.join(SOURCE_CACHE_DIR, "objects", reader.read().strip())
+        if objectPath is not None and os.path.exists(objectPath):
+            os.utime(objectPath) # Most recently used entries are evicted last
+            linkOrCopyFile(objectPath, filePath)
+            updateSourceCacheStats(hits=1, bytesSaved=os.path.getsize(objectPath))
+            return
+
+        # The partial download is named after the key and kept when the download fails, so a retried task resumes it.
+        # The key lock makes this process its only writer
+        tempPath = os.path.join(SOURCE_CACHE_DIR, "tmp", f"{keyHash}.part")
+        download(tempPath)
+        contentHash = getFileHash(tempPath)
+        objectPath = os.path.join(SOURCE_CACHE_DIR, "objects", contentHash)
+        os.replace(tempPath, objectPath)
+        writeFileAtomically(keyPath, contentHash)
+        linkOrCopyFile(objectPath, filePath)
+        updateSourceCacheStats(misses=1)
+
+    evictSourceCache(keepPaths={objectPath})
+
+
+def getFileHash(filePath):
+    fileHash = hashlib.sha256()
+    with open(filePath, "rb") as reader:
+        for chunk in iter(lambda: reader.read(1024 * 1024), b""):
+            fileHash.update(chunk)
+    return fileHash.hexdigest()
+
+
+def writeFileAtomically(filePath, content):
+    tempPath = f"{filePath}.{uuid.uuid4().hex}.tmp"
+    with open(tempPath, "w") as writer:
+        writer.write(content)
+    os.replace(tempPath, filePath)
+
+
+def linkOrCopyFile(sourcePath, filePath):
+    # Hard links cost no space when the cache and the working folder share a file system. The link or copy gets a
+    # temporary name in the target folder and is renamed into place, so tasks checking for filePath without the
+    # cache lock never see it missing or half copied
+    tempPath = f"{filePath}.{uuid.uuid4().hex}.tmp"
+    try:
+        try:
+            os.link(sourcePath, tempPath)
+        except OSError:
+            shutil.copyfile(sourcePath, tempPath)
+        os.replace(tempPath, filePath)
+    finally:
+        removeFile(tempPath)
+
+
+def evictSourceCache(keepPaths=()):
+    # Partial downloads nobody resumed within the retry window are dropped
+    expiresBefore = time.time() - CHECKPOINT_TTL_SECONDS
+    for entry in os.scandir(os.path.join(SOURCE_CACHE_DIR, "tmp")):
+        try:
+            if entry.stat().st_mtime < expiresBefore:
+                removeFile(entry.path)
+        except FileNotFoundError:
+            continue
+
+    objectsFolder = os.path.join(SOURCE_CACHE_DIR, "objects")
+    entries = []
+    for entry in os.scandir(objectsFolder):
+        try:
+            entryStat = entry.stat()
+        except FileNotFoundError: # Evicted by another worker
+            continue
+        entries.append((entryStat.st_mtime, entryStat.st_size, entry.path))
+
+    cacheSize = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if cacheSize <= SOURCE_CACHE_MAX_BYTES:
+            break
+        if path in keepPaths:
+            continue
+        # Key files pointing at an evicted object are treated as misses and rewritten on the next download
+        removeFile(path)
+        cacheSize -= size
+
+
+def updateSourceCacheStats(hits=0, misses=0, bytesSaved=0):
+    with sourceCacheStatsLock:
+        sourceCacheStats["hits"] += hits
+        sourceCacheStats["misses"] += misses
+        sourceCacheStats["bytesSaved"] += bytesSaved
+        print(f"Source cache stats: {sourceCacheStats}")
+    incrementMetric("cache_requests_total", 1, {"cache": "source", "result": "hit" if hits else "miss"})
+    if bytesSaved:
+        incrementMetric("source_cache_saved_bytes_total", bytesSaved)
 
 
 def checkDir(folderName):
@@ -147,106 +876,371 @@ def removeFile(filePath):
         print(f"Failed to delete {filePath}. Reason: {e}")
 
 
-def getVideoInfo(videoPath):
+def probeMedia(mediaPath, withKeyframes=False):
+    # Reads container and stream headers only, no packets are counted. Results are cached by path, size and mtime
+    # so every stage of a task shares one probe per file
+    fileStat = os.stat(mediaPath)
+    cacheKey = (os.path.abspath(mediaPath), fileStat.st_size, fileStat.st_mtime_ns)
+    with mediaInfoCacheLock:
+        mediaInfo = mediaInfoCache.get(cacheKey)
+    if mediaInfo is not None and (not withKeyframes or mediaInfo.keyframes is not None):
+        return mediaInfo
+
+    if mediaInfo is None:
+        cmd = ["ffprobe", "-v", "error", "-show_streams", "-show_format", "-of", "json", mediaPath]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe failed for {mediaPath}: {result.stderr}")
+        mediaInfo = parseMediaInfo(json.loads(result.stdout))
+
+    if withKeyframes:
+        mediaInfo = mediaInfo._replace(keyframes=probeKeyframes(mediaPath))
+
+    with mediaInfoCacheLock:
+        if len(mediaInfoCache) >= MEDIA_INFO_CACHE_SIZE:
+            mediaInfoCache.pop(next(iter(mediaInfoCache)))
+        mediaInfoCache[cacheKey] = mediaInfo
+    return mediaInfo
+
+
+def parseMediaInfo(data):
+    streams = data.get("streams", [])
+    videoStream = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    if videoStream is None:
+        raise ValueError("No video stream found")
+
+    # Width and height are reported as displayed, phone videos stored sideways carry a 90 degree rotation
+    rotation = int(float(videoStream.get("tags", {}).get("rotate", 0)))
+    for sideData in videoStream.get("side_data_list", []):
+        if "rotation" in sideData:
+            rotation = int(float(sideData["rotation"]))
+    width, height = videoStream.get("width"), videoStream.get("height")
+    if rotation % 180 != 0:
+        width, height = height, width
+
+    fps = 0.0
+    for frameRate in (videoStream.get("avg_frame_rate"), videoStream.get("r_frame_rate")):
+        numerator, _, denominator = (frameRate or "0/0").partition("/")
+        if float(denominator or 1) > 0 and float(numerator) > 0:
+            fps = float(numerator) / float(denominator or 1)
+            break
+
+    formatInfo = data.get("format", {})
+    duration = float(formatInfo.get("duration") or videoStream.get("duration") or 0)
+    bitrate = videoStream.get("bit_rate") or formatInfo.get("bit_rate")
+
+    return MediaInfo(
+        width=width,
+        height=height,
+        fps=fps,
+        duration=duration,
+        bitrate=int(bitrate) if bitrate not in (None, "N/A") else None,
+        hasAudio=any(stream.get("codec_type") == "audio" for stream in streams),
+        keyframes=None,
+    )
+
+
+def probeKeyframes(mediaPath):
+    # Packet headers carry the keyframe flag, so the index is read without decoding
     cmd = [
-        "ffprobe",
-        "-v",
-        "error",
-        "-select_streams",
-        "v:0",
-        "-count_packets",
-        "-show_entries",
-        "stream=width,height",
-        "-show_entries",
-        "format=duration",
-        "-of",
-        "json",
-        videoPath,
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", mediaPath
     ]
+    output = subprocess.check_output(cmd, text=True)
+    keyframes = []
+    for line in output.splitlines():
+        ptsTime, _, flags = line.partition(",")
+        if "K" in flags and ptsTime not in ("", "N/A"):
+            keyframes.append(float(ptsTime))
+    return tuple(sorted(keyframes))
 
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
 
-    if result.returncode != 0:
-        print("Error:", result.stderr)
+def getVideoInfo(videoPath):
+    try:
+        mediaInfo = probeMedia(videoPath)
+    except (RuntimeError, ValueError, OSError) as e:
+        print("Error:", e)
         return None
+    return {"width": mediaInfo.width, "height": mediaInfo.height, "duration": int(mediaInfo.duration)}
 
-    data = json.loads(result.stdout)
 
-    if "streams" in data and len(data["streams"]) > 0 and "format" in data:
-        stream = data["streams"][0]
-        width = stream.get("width")
-        height = stream.get("height")
-        duration = int(float(data["format"].get("duration", 0)))
-        return {"width": width, "height": height, "duration": duration}
-    else:
-        return None
+def getDriveService(scopes):
+    # httplib2 connections are not thread safe, so every thread keeps its own clients. Clients inherited through fork
+    # are dropped so processes never share a socket
+    if getattr(driveServices, "pid", None) != os.getpid():
+        driveServices.pid = os.getpid()
+        driveServices.services = {}
 
+    scopesKey = tuple(sorted(scopes))
+    service = driveServices.services.get(scopesKey)
+    with driveServiceStatsLock:
+        driveServiceStats["hits" if service is not None else "misses"] += 1
+    incrementMetric("cache_requests_total", 1, {"cache": "drive_client", "result": "hit" if service is not None else "miss"})
+    if service is not None:
+        return service
 
-def uploadToDrive(filePath, fileName, folderId):
-    SERVICE_ACCOUNT_FILE = "creds.json"
-    SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+    # AuthorizedHttp refreshes the service account token before a request once it has expired and keeps the
+    # underlying connection alive between requests
+    credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=list(scopesKey), subject=USER_ACCOUNT_EMAIL)
+    authorizedHttp = AuthorizedHttp(credentials, http=httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+    service = build("drive", "v3", http=authorizedHttp, cache_discovery=False)
+    driveServices.services[scopesKey] = service
+    print(f"Drive client created for {list(scopesKey)}, cache stats: {getDriveServiceStats()}")
+    return service
+
+
+def getDriveServiceStats():
+    with driveServiceStatsLock:
+        return dict(driveServiceStats)
 
-    userAccountEmail = USER_ACCOUNT_EMAIL
-    credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES, subject=userAccountEmail)
 
-    service = build("drive", "v3", credentials=credentials)
+def uploadToDrive(filePath, fileName, folderId):
+    service = getDriveService(["https://www.googleapis.com/auth/drive.file"])
     media = MediaFileUpload(filePath, resumable=True)
     fileMetadata = {"name": fileName, "parents": [folderId]}
-    file = service.files().create(body = fileMetadata, media_body = media, fields = "id").execute()
+    with timedStage("drive_upload"):
+        file = service.files().create(body = fileMetadata, media_body = media, fields = "id").execute()
+    incrementMetric("bytes_total", os.path.getsize(filePath), {"direction": "upload", "target": "drive"})
     fileUrl = driveDownloadBaseUrl + file.get("id")
     return fileUrl
 
 
+def getUploadExecutor():
+    # One pool per worker process, pools inherited through fork have no threads and are replaced
+    global uploadExecutor, uploadExecutorPid
+    with uploadExecutorLock:
+        if uploadExecutor is None or uploadExecutorPid != os.getpid():
+            uploadExecutor, uploadExecutorPid = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS), os.getpid()
+        return uploadExecutor
+
+
+class UploadQueue:
+    """Uploads the files of one task to Drive on the process's upload threads while the caller keeps encoding.
+
+    submit blocks once maxPending uploads of the task are queued or running, so finished files can't pile up on disk
+    faster than they leave it. Local files are removed as soon as their upload is confirmed.
+    """
+
+    def __init__(self, maxPending=None):
+        self.executor = getUploadExecutor()
+        self.pendingSlots = threading.BoundedSemaphore(maxPending or UPLOAD_QUEUE_SIZE)
+        self.futures = []
+
+    def submit(self, filePath, fileName, folderId, onUploaded=None):
+        self.pendingSlots.acquire()
+        try:
+            future = self.executor.submit(self.upload, filePath, fileName, folderId, onUploaded)
+        except Exception:
+            self.pendingSlots.release()
+            raise
+        self.futures.append(future)
+        return future
+
+    def upload(self, filePath, fileName, folderId, onUploaded=None):
+        try:
+            fileUrl = uploadToDrive(filePath, fileName, folderId)
+            removeFile(filePath)
+            if onUploaded is not None:
+                onUploaded(fileUrl)
+            return fileUrl
+        finally:
+            self.pendingSlots.release()
+
+    def wait(self):
+        # Every upload finishes before a failure is raised, the threads stay up for the next task
+        waitForFutures(self.futures)
+        return [future.result() for future in self.futures]
+
+
 def getVideoBitrate(filePath):
-    cmd = [
-        "ffprobe",
-        "-v", "quiet",
-        "-select_streams", "v:0",
-        "-print_format", "json",
-        "-show_entries", "stream=bit_rate",
-        filePath,
-    ]
+    return probeMedia(filePath).bitrate
+
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    data = json.loads(result.stdout)
-    return int(data["streams"][0]["bit_rate"])
+def processFrames(cap, frameTransform, writeFrame, workers=None, stage="frames"):
+    # Decoding runs on its own thread into a ring of preallocated frames, worker threads transform the frames and the
+    # calling thread encodes them back in decode order. NumPy, OpenCV and pipe writes release the GIL so the stages
+    # overlap and the transforms spread over the cores. writeFrame returning False stops the pipeline early
+    workers = max(1, workers or FRAME_WORKERS)
+    bufferSize = workers * 2 + 2
+    frameWidth = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frameHeight = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frameBuffers = [np.empty((frameHeight, frameWidth, 3), dtype=np.uint8) for _ in range(bufferSize)]
+    reporter = ProgressReporter(stage, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+    freeSlots = queue.Queue()
+    for slot in range(bufferSize):
+        freeSlots.put(slot)
+    decodedFrames = queue.Queue()
+    transformedFrames = queue.Queue()
+    stopped = threading.Event()
+
+    def decode():
+        try:
+            sequence = 0
+            while not stopped.is_set():
+                slot = freeSlots.get()
+                if stopped.is_set():
+                    break
+                ret, frame = cap.read(frameBuffers[slot])
+                if not ret:
+                    break
+                frameBuffers[slot] = frame # Same array unless the decoder changed the frame geometry
+                decodedFrames.put((sequence, slot))
+                sequence += 1
+        except Exception as e:
+            transformedFrames.put((None, None, e))
+        finally:
+            for _ in range(workers):
+                decodedFrames.put(None)
+
+    def transform():
+        while True:
+            item = decodedFrames.get()
+            if item is None:
+                transformedFrames.put(None)
+                return
+            sequence, slot = item
+            if stopped.is_set():
+                continue
+            try:
+                transformedFrames.put((sequence, slot, frameTransform(frameBuffers[slot], frameHeight, frameWidth)))
+            except Exception as e:
+                transformedFrames.put((None, None, e))
+
+    threads = [threading.Thread(target=decode, daemon=True)]
+    threads.extend(threading.Thread(target=transform, daemon=True) for _ in range(workers))
+    for thread in threads:
+        thread.start()
+
+    framesProcessed = 0
+    pendingFrames = {}
+    runningWorkers = workers
+    try:
+        while runningWorkers > 0:
+            item = transformedFrames.get()
+            if item is None:
+                runningWorkers -= 1
+                continue
+            sequence, slot, result = item
+            if sequence is None:
+                raise result
+            pendingFrames[sequence] = (slot, result)
+            while framesProcessed in pendingFrames:
+                slot, frame = pendingFrames.pop(framesProcessed)
+                framesProcessed += 1
+                keepGoing = writeFrame(frame)
+                freeSlots.put(slot)
+                reporter.update(framesProcessed)
+                if keepGoing is False:
+                    return framesProcessed
+        return framesProcessed
+    finally:
+        stopped.set()
+        # Wakes the decoder if it waits for a slot, the workers then drain the frames left in the queue
+        for _ in range(bufferSize):
+            freeSlots.put(0)
+        for thread in threads:
+            thread.join()
 
 
 def deleteRandomPixels(folderName, fileName, variantId):
     inputVideo = f"{folderName}/{fileName}.mp4"
-    tempVideoWithoutAudio = f"{folderName}/{fileName}_no_audio.mp4"
-    outputVideo = f"{folderName}/{fileName}_pixels.mp4"
+    # Working files carry the variant id so variants rendered in parallel don't collide
+    tempVideoWithoutAudio = f"{folderName}/{fileName}_{variantId}_no_audio.mp4"
+    outputVideo = f"{folderName}/{fileName}_{variantId}_pixels.mp4"
 
     cap = cv2.VideoCapture(inputVideo)
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     frameWidth = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frameHeight = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    # The probed rate keeps fractional rates like 29.97 that CAP_PROP_FPS truncated, frame geometry stays with
+    # OpenCV since it is what the decoded frames actually have
+    fps = probeMedia(inputVideo).fps or cap.get(cv2.CAP_PROP_FPS)
 
     # algoId = random.randint(1, 3)
     algoId = variantId
     percentage = 0.01
 
     out = cv2.VideoWriter(tempVideoWithoutAudio, fourcc, fps, (frameWidth, frameHeight))
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame = deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, algoId, percentage)
-        out.write(frame)
-    cap.release()
+    try:
+        framesProcessed = processFrames(
+            cap,
+            lambda frame, frameHeight, frameWidth: deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, algoId, percentage),
+            out.write,
+            stage="pixels"
+        )
+    finally:
+        cap.release()
     out.release()
-    mergeAudioWithVideo(inputVideo, tempVideoWithoutAudio, outputVideo)
-    return f"{fileName}_pixels"
+    incrementMetric("frames_processed_total", framesProcessed, {"stage": "pixels"})
+    mergeAudioWithVideo(getSourceAudio(inputVideo), tempVideoWithoutAudio, outputVideo)
+    removeFile(tempVideoWithoutAudio)
+    return f"{fileName}_{variantId}_pixels"
+
+
+def getSourceAudio(videoPath):
+    # None of the variant effects touch the audio, so it is encoded once per source and stream copied into every
+    # output. The file sits next to the source and is removed with it
+    audioFile = f"{os.path.splitext(videoPath)[0]}_audio.m4a"
+    if os.path.exists(audioFile):
+        return audioFile
+    if not probeMedia(videoPath).hasAudio:
+        return None
+
+    # Variants rendered in parallel may extract it at the same time, the rename keeps readers off partial files
+    tempAudioFile = f"{os.path.splitext(videoPath)[0]}_audio.{uuid.uuid4().hex}.m4a"
+    ffmpegCommand = [
+        "ffmpeg", "-y",
+        "-i", videoPath,
+        "-map", "0:a:0",
+        "-vn",
+        "-c:a", "aac",
+        "-b:a", "192k",
+        tempAudioFile
+    ]
+    try:
+        subprocess.run(ffmpegCommand, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        print("FFmpeg error:", e.stderr)
+        removeFile(tempAudioFile)
+        raise
+    os.replace(tempAudioFile, audioFile)
+    return audioFile
+
+
+def removeSourceFiles(folderName, fileName):
+    removeFile(f"{folderName}/{fileName}.mp4")
+    removeFile(f"{folderName}/{fileName}_audio.m4a")
 
 
-def mergeAudioWithVideo(originalVideo, processedVideo, outputVideo):
+@contextmanager
+def sharedSource(folderName, fileName):
+    # Variant tasks of one record on the same host share its source and audio. Each holds a shared lock while it uses
+    # them, and the last one to finish, the only one that gets the exclusive lock, removes them
+    lockPath = f"{folderName}/{fileName}.lock"
+    with open(lockPath, "a") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_SH)
+        yield
+    with open(lockPath, "a") as lockFile:
+        try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        removeSourceFiles(folderName, fileName)
+        removeFile(lockPath)
+
+
+def mergeAudioWithVideo(audioFile, processedVideo, outputVideo):
+    if audioFile is None:
+        os.replace(processedVideo, outputVideo)
+        return
+
     ffmpegCommand = [
-        "ffmpeg",
+        "ffmpeg", "-y",
         "-i", processedVideo,
-        "-i", originalVideo,
+        "-i", audioFile,
         "-c:v", "copy",
-        "-c:a", "aac",
+        "-c:a", "copy",
         "-map", "0:v:0",
         "-map", "1:a:0",
         "-shortest",
@@ -256,6 +1250,37 @@ def mergeAudioWithVideo(originalVideo, processedVideo, outputVideo):
 
 
 def deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, originalAlgoId, percentage=0.01):
+    if PIXEL_ENGINE == "python":
+        return deleteRandomPixelsInFrameLoop(frame, frameHeight, frameWidth, originalAlgoId, percentage)
+
+    totalPixels = frameHeight * frameWidth
+    numPixelsToDelete = int(totalPixels * percentage)
+    if numPixelsToDelete == 0:
+        return frame
+
+    # All target pixels are picked at once and their 3x3 neighbourhoods gathered into an (N, 9, channels) array,
+    # neighbours falling outside the frame are masked out instead of being clamped onto the border
+    xs = np.random.randint(0, frameWidth, numPixelsToDelete)
+    ys = np.random.randint(0, frameHeight, numPixelsToDelete)
+
+    if originalAlgoId == 2:
+        algoIds = np.random.choice([1, 3, 4], numPixelsToDelete)
+    else:
+        algoIds = np.full(numPixelsToDelete, originalAlgoId)
+
+    neighbourYs = ys[:, None] + neighbourOffsetsY
+    neighbourXs = xs[:, None] + neighbourOffsetsX
+    validNeighbours = (neighbourYs >= 0) & (neighbourYs < frameHeight) & (neighbourXs >= 0) & (neighbourXs < frameWidth)
+    neighbours = frame[np.clip(neighbourYs, 0, frameHeight - 1), np.clip(neighbourXs, 0, frameWidth - 1)].astype(np.float32)
+
+    for algoId, getColors in ((1, getAverageColors), (3, getMedianColors), (4, getWeightedAverageColors)):
+        selected = algoIds == algoId
+        if selected.any():
+            frame[ys[selected], xs[selected]] = getColors(neighbours[selected], validNeighbours[selected])
+    return frame
+
+
+def deleteRandomPixelsInFrameLoop(frame, frameHeight, frameWidth, originalAlgoId, percentage=0.01):
     totalPixels = frameHeight * frameWidth
     numPixelsToDelete = int(totalPixels * percentage)
 
@@ -274,6 +1299,8 @@ def deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, originalAlgoId, pe
             averageColor = getMedianColor(frame, x, y, frameHeight, frameWidth)
         elif algoId == 4:
             averageColor = getWeightedAverageColor(frame, x, y, frameHeight, frameWidth)
+        else:
+            continue
         # if algoId == 5:
         #     averageColor = getAverageColor(frame, x, y, frameHeight, frameWidth)
 
@@ -281,6 +1308,30 @@ def deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, originalAlgoId, pe
     return frame
 
 
+def getAverageColors(neighbours, validNeighbours):
+    validCount = validNeighbours.sum(axis=1)[:, None]
+    neighbourSum = (neighbours * validNeighbours[:, :, None]).sum(axis=1)
+    return (neighbourSum / validCount).astype(np.uint8)
+
+
+def getMedianColors(neighbours, validNeighbours):
+    medianColors = np.empty((neighbours.shape[0], neighbours.shape[2]), dtype=np.float32)
+    interior = validNeighbours.all(axis=1)
+    medianColors[interior] = np.median(neighbours[interior], axis=1)
+    if not interior.all():
+        # Edge pixels have 4 or 6 neighbours, nanmedian drops the masked ones like the cropped slice did
+        edgeNeighbours = neighbours[~interior]
+        edgeNeighbours[~validNeighbours[~interior]] = np.nan
+        medianColors[~interior] = np.nanmedian(edgeNeighbours, axis=1)
+    return medianColors.astype(np.uint8)
+
+
+def getWeightedAverageColors(neighbours, validNeighbours):
+    weights = weightedKernel * validNeighbours
+    weightedSum = (neighbours * weights[:, :, None]).sum(axis=1)
+    return (weightedSum / weights.sum(axis=1)[:, None]).astype(np.uint8)
+
+
 # Detected on upload - Not working
 def modifyPixelColor(frame, x, y, frameHeight, frameWidth):
     originalColor = frame[y, x]
@@ -334,7 +1385,21 @@ def swapColumns(frame, startCol1, endCol1, startCol2, endCol2):
     return frame
 
 
-def swapVideoSides(processedVideos, fileName):
+def swapVideoSidesInFrame(frame, frameHeight, frameWidth):
+    colsToSwap = 20
+    startColLeft = int(frameWidth * 0.15) + colsToSwap
+    endColLeft = startColLeft + colsToSwap
+    startColRight = int(frameWidth * 0.85)
+    endColRight = startColRight + colsToSwap
+
+    # Blocks that would run past the right edge of narrow videos are left alone
+    for startCol, endCol in ((startColLeft, endColLeft), (startColRight, endColRight)):
+        if endCol + colsToSwap + 20 <= frameWidth:
+            frame = swapColumns(frame, startCol, endCol, endCol + 20, endCol + colsToSwap + 20)
+    return frame
+
+
+def swapVideoSides(processedVideos, fileName, audioFile=None):
     inputFilePath = f"{processedVideos}/{fileName}.mp4"
     cap = cv2.VideoCapture(inputFilePath)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -345,25 +1410,16 @@ def swapVideoSides(processedVideos, fileName):
     outputFilePath = f"{processedVideos}/{fileName}_cut.mp4"
     out = cv2.VideoWriter(outputFilePath, fourcc, fps, (width, height))
 
-    colsToSwap = 20
-    startColLeft = int(width * 0.15) + colsToSwap
-    endColLeft = startColLeft + colsToSwap
-    startColRight = int(width * 0.85)
-    endColRight = startColRight + colsToSwap
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        # TODO Check width of video before swap
-        frame = swapColumns(frame, startColLeft, endColLeft, endColLeft + 20, endColLeft + colsToSwap + 20)
-        frame = swapColumns(frame, startColRight, endColRight, endColRight + 20, endColRight + colsToSwap + 20)
-        out.write(frame)
-    cap.release()
+    try:
+        framesProcessed = processFrames(cap, swapVideoSidesInFrame, out.write, stage="swap")
+    finally:
+        cap.release()
     out.release()
+    incrementMetric("frames_processed_total", framesProcessed, {"stage": "swap"})
     cv2.destroyAllWindows()
     outputVideoUpdated = f"{processedVideos}/{fileName}_cut_audio.mp4"
-    mergeAudioWithVideo(inputFilePath, outputFilePath, outputVideoUpdated)
+    mergeAudioWithVideo(audioFile or getSourceAudio(inputFilePath), outputFilePath, outputVideoUpdated)
+    removeFile(outputFilePath)
     return f"{fileName}_cut_audio"
 
 
@@ -386,17 +1442,12 @@ def sharpenVideo(inputFile, outputFile):
         print(f"Error occurred while sharpening video: {e}")
 
 
-def processVideo(processedVideos, fileName, processingSpecs):
+def getVideoMetadata():
     locationName, locationIso6709 = random.choice(list(locations.items()))
 
     randomDate = datetime.now() - timedelta(hours=random.randint(0, 24))
     dateStr = randomDate.strftime("%Y-%m-%dT%H:%M:%S")
 
-    variantId = processingSpecs["VariantId"]
-    fileName = deleteRandomPixels(processedVideos, fileName, variantId)
-
-    # fileName = "recUk02J1czaRqI6J_pixels"
-
     metadata = {
         "make": "Apple",
         "model": "iPhone 14 Pro",
@@ -410,12 +1461,83 @@ def processVideo(processedVideos, fileName, processingSpecs):
         "com.apple.quicktime.location.ISO6709": locationIso6709,
         "com.apple.quicktime.location.accuracy.horizontal": "6297.954794",
     }
-
-    videoDimensions = getVideoInfo(f"{processedVideos}/{fileName}.mp4")
-    # bitrate = getVideoBitrate(f"{processedVideos}/{fileName}.mp4")
-    # print(bitrate)
-    # bitrateKbps = f"{(bitrate) // 1000}k"
-    # print(bitrateKbps)
+    return metadata
+
+
+def getPixelFilters(variantId, percentage=0.01):
+    # geq draws one random number per pixel into a gray mask that selects the same share of pixels as
+    # deleteRandomPixelsInFrame, maskedmerge then swaps them for the 3x3 mean, median or weighted mean of their
+    # neighbourhood. Only the mask is computed per pixel by an expression, the neighbourhood filters are native
+    neighbourFilters = {1: "avgblur=sizeX=1", 3: "median=radius=1", 4: "convolution='1 2 1 2 4 2 1 2 1':'1 2 1 2 4 2 1 2 1':'1 2 1 2 4 2 1 2 1':'1 2 1 2 4 2 1 2 1':1/16:1/16:1/16:1/16"}
+    if variantId == 2:
+        algoIds = [1, 3, 4]
+    elif variantId in neighbourFilters:
+        algoIds = [variantId]
+    else:
+        return ""
+
+    # Mask values count the algorithm shares above the pixel's draw, 0 leaves the pixel untouched and n - index picks
+    # the algorithm at that index
+    share = percentage / len(algoIds)
+    maskCode = "+".join(f"lt(ld(0),{share * (index + 1)})" for index in range(len(algoIds)))
+    # random(1) keeps its state in register 1, which starts at 0 in every geq instance and in each of its slice
+    # threads. It is reseeded at the start of every row from a per render seed, the frame number and the row, with two
+    # draws discarded so neighbouring seeds don't start out alike. The mask then differs per render and frame and
+    # doesn't depend on how geq splits the frame into slices
+    seed = random.getrandbits(32)
+    seedCode = f"if(eq(X,0),st(1,{seed}+N*H+Y)+random(1)+random(1))"
+    filterChains = [
+        f"split={len(algoIds) + 2}[pixelsSource][pixelsMaskInput]" + "".join(f"[pixelsInput{algoId}]" for algoId in algoIds),
+        f"[pixelsMaskInput]format=gray,geq=lum='{seedCode};st(0,random(1));{maskCode}',split={len(algoIds)}" + "".join(f"[pixelsCodes{algoId}]" for algoId in algoIds),
+    ]
+    previousLabel = "pixelsSource"
+    for index, algoId in enumerate(algoIds):
+        filterChains.append(f"[pixelsInput{algoId}]{neighbourFilters[algoId]}[pixelsFiltered{algoId}]")
+        filterChains.append(f"[pixelsCodes{algoId}]lut=c0='255*eq(val,{len(algoIds) - index})',format=gbrp[pixelsMask{algoId}]")
+        merge = f"[{previousLabel}][pixelsFiltered{algoId}][pixelsMask{algoId}]maskedmerge"
+        previousLabel = f"pixelsMerged{algoId}"
+        filterChains.append(merge if index == len(algoIds) - 1 else f"{merge}[{previousLabel}]")
+    return ";".join(filterChains)
+
+
+def getSwapFilters(videoDimensions):
+    # Same column blocks as swapVideoSidesInFrame, blocks that would run past the right edge are left alone
+    colsToSwap = 20
+    startColLeft = int(videoDimensions["width"] * 0.15) + colsToSwap
+    startColRight = int(videoDimensions["width"] * 0.85)
+
+    swapFilters = []
+    for index, startCol in enumerate((startColLeft, startColRight)):
+        otherCol = startCol + colsToSwap * 2
+        if otherCol + colsToSwap > videoDimensions["width"]:
+            continue
+        swapFilters.append(
+            f"split=3[swapBase{index}][swapFirst{index}][swapSecond{index}];"
+            f"[swapFirst{index}]crop={colsToSwap}:ih:{startCol}:0[swapFirstCols{index}];"
+            f"[swapSecond{index}]crop={colsToSwap}:ih:{otherCol}:0[swapSecondCols{index}];"
+            f"[swapBase{index}][swapSecondCols{index}]overlay={startCol}:0:format=gbrp[swapHalf{index}];"
+            f"[swapHalf{index}][swapFirstCols{index}]overlay={otherCol}:0:format=gbrp"
+        )
+    return ",".join(swapFilters)
+
+
+def getEffectFilters(videoDimensions, processingSpecs):
+    # Filtergraph version of the OpenCV passes, run on planar RGB so every plane picks the same pixels
+    effectFilters = [getPixelFilters(processingSpecs["VariantId"])]
+    if processingSpecs.get("SwapSides"):
+        effectFilters.append(getSwapFilters(videoDimensions))
+    effectFilters = [effectFilter for effectFilter in effectFilters if effectFilter]
+    if not effectFilters:
+        return ""
+    return ",".join(["format=gbrp", *effectFilters]) + ","
+
+
+def getZoomStart(videoDimensions):
+    return random.randint(0, videoDimensions["duration"] - 5)
+
+
+def getVideoFilters(videoDimensions, processingSpecs, timeOffset=0, zoomStart=None):
+    variantId = processingSpecs["VariantId"]
 
     angleRadians = math.radians(processingSpecs["RotationAngle"])
 
@@ -452,47 +1574,354 @@ def processVideo(processedVideos, fileName, processingSpecs):
     #     os.rename(f"{processedVideos}/{fileName}_sharped.mp4", f"{processedVideos}/{fileName}.mp4")
     # if variantId ==  4:
 
+    # zoompan's time starts at zero for every input, chunks encoded on their own add their offset to get the source time
+    timeExpr = f"(time+{timeOffset})" if timeOffset else "time"
     if variantId == 3 or variantId ==  4:
-        startingPoint = random.randint(0, videoDimensions["duration"] - 5)
-        zoomEffect = f"zoompan=z='if(gte(time,{startingPoint}),if(lt(time,{startingPoint}+2),1+((time-{startingPoint})/2),if(lt(time,{startingPoint}+3),2,if(lt(time,{startingPoint}+5),2-((time-{startingPoint}-3)/2),1))),1)':d=1:x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={videoDimensions['width']}x{videoDimensions['height']}:fps=30,"
+        startingPoint = zoomStart if zoomStart is not None else getZoomStart(videoDimensions)
+        zoomEffect = f"zoompan=z='if(gte({timeExpr},{startingPoint}),if(lt({timeExpr},{startingPoint}+2),1+(({timeExpr}-{startingPoint})/2),if(lt({timeExpr},{startingPoint}+3),2,if(lt({timeExpr},{startingPoint}+5),2-(({timeExpr}-{startingPoint}-3)/2),1))),1)':d=1:x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={videoDimensions['width']}x{videoDimensions['height']}:fps=30,"
     elif variantId == 1:
-        zoomEffect = f"zoompan=z='if(lt(time,2),2-(time/2),1)':d=1:x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={videoDimensions['width']}x{videoDimensions['height']}:fps=30,"
+        zoomEffect = f"zoompan=z='if(lt({timeExpr},2),2-({timeExpr}/2),1)':d=1:x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={videoDimensions['width']}x{videoDimensions['height']}:fps=30,"
     # elif variantId != 2  and variantId != 3 and videoDimensions["duration"]  >= 5:
     elif variantId != 2 and videoDimensions["duration"]  >= 5:
-        zoomEffect = f"zoompan=z='if(lt(time,2),2-(time/2),1)':d=1:x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={videoDimensions['width']}x{videoDimensions['height']}:fps=30,"
+        zoomEffect = f"zoompan=z='if(lt({timeExpr},2),2-({timeExpr}/2),1)':d=1:x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s={videoDimensions['width']}x{videoDimensions['height']}:fps=30,"
 
-    ffmpegCommand = [
-        "ffmpeg",
-        "-i", f"{processedVideos}/{fileName}.mp4",
-        "-vf", f'{mirrorCommand}{zoomEffect}rotate={processingSpecs["RotationAngle"]}*PI/180,crop={updatedDimensions["width"]}:{updatedDimensions["height"]},scale={videoDimensions["width"]}:{videoDimensions["height"]}:flags=lanczos,eq=contrast={processingSpecs["Contrast"]}:brightness={processingSpecs["Brightness"]}:saturation={processingSpecs["Saturation"]}:gamma={processingSpecs["Gamma"]}',
+    effectFilters = getEffectFilters(videoDimensions, processingSpecs) if PIXEL_EFFECT_MODE == "ffmpeg" else ""
+
+    return f'{effectFilters}{mirrorCommand}{zoomEffect}rotate={processingSpecs["RotationAngle"]}*PI/180,crop={updatedDimensions["width"]}:{updatedDimensions["height"]},scale={videoDimensions["width"]}:{videoDimensions["height"]}:flags=lanczos,eq=contrast={processingSpecs["Contrast"]}:brightness={processingSpecs["Brightness"]}:saturation={processingSpecs["Saturation"]}:gamma={processingSpecs["Gamma"]}'
+
+
+def getVideoCodecArgs():
+    return [
         "-c:v", "libx264",
         "-preset", "slow",
         "-crf", "18",
-        "-c:a", "aac",
-        "-b:a", "192k",
+        "-pix_fmt", "yuv420p"
+    ]
+
+
+def getMuxArgs():
+    # Audio, container flags and metadata of the final file
+    muxArgs = [
+        "-c:a", "copy",
         "-movflags", "+faststart"
     ]
-    for key, value in metadata.items():
-        ffmpegCommand.extend(["-metadata", f"{key}={value}"])
+    for key, value in getVideoMetadata().items():
+        muxArgs.extend(["-metadata", f"{key}={value}"])
+    return muxArgs
 
-    ffmpegCommand.append(f"{processedVideos}/{fileName}_{processingSpecs['VariantId']}.mov")
 
+def getEncodeArgs(videoDimensions, processingSpecs, outputVideo, threads=None):
+    return [
+        "-vf", getVideoFilters(videoDimensions, processingSpecs),
+        *getVideoCodecArgs(),
+        *getMuxArgs(),
+        "-threads", str(threads or FFMPEG_THREADS),
+        outputVideo
+    ]
+
+
+def getAudioInputArgs(audioFile, inputIndex):
+    # The encoded source audio as an extra input, mapped next to the video of input 0
+    if audioFile is None:
+        return [], []
+    return ["-i", audioFile], ["-map", "0:v:0", "-map", f"{inputIndex}:a:0"]
+
+
+def getLosslessEncodeArgs(outputVideo, threads=None):
+    # Intermediate of chunked encodes, qp 0 and full chroma keep the single pixel changes for the final encode
+    return [
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-qp", "0",
+        "-pix_fmt", "yuv444p",
+        "-c:a", "copy",
+        "-threads", str(threads or FFMPEG_THREADS),
+        outputVideo
+    ]
+
+
+def getEncodeChunkCount(duration):
+    return min(ENCODE_CHUNKS, int(duration // ENCODE_CHUNK_MIN_SECONDS))
+
+
+def encodeVideo(inputVideo, videoDimensions, processingSpecs, outputVideo, threads=None, audioFile=None):
+    chunks = getEncodeChunkCount(videoDimensions["duration"])
     try:
-        subprocess.run(ffmpegCommand, check=True, capture_output=True, text=True)
+        if chunks > 1:
+            encodeVideoInChunks(inputVideo, videoDimensions, processingSpecs, outputVideo, chunks, threads, audioFile)
+        else:
+            audioInput, audioMap = getAudioInputArgs(audioFile, 1)
+            ffmpegCommand = [
+                "ffmpeg", "-y", "-i", inputVideo, *audioInput,
+                *(audioMap or ["-map", "0:v:0", "-an"]),
+                *getEncodeArgs(videoDimensions, processingSpecs, outputVideo, threads)
+            ]
+            runFfmpegWithProgress(ffmpegCommand, ProgressReporter("encode", getFrameCount(inputVideo)))
     except subprocess.CalledProcessError as e:
         print("FFmpeg error:", e.stderr)
         raise
-    removeFile(f"{processedVideos}/{fileName}.mp4")
+
+
+def encodeVideoInChunks(inputVideo, videoDimensions, processingSpecs, outputVideo, chunks, threads=None, audioFile=None):
+    chunkFolder = f"{os.path.splitext(outputVideo)[0]}_chunks"
+    checkDir(chunkFolder)
+    try:
+        # Stream copy cuts on the first keyframe after every split time, so chunks decode on their own
+        splitCommand = [
+            "ffmpeg", "-y", "-i", inputVideo,
+            "-map", "0:v:0",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(videoDimensions["duration"] / chunks),
+            "-reset_timestamps", "1",
+            "-segment_list", "pipe:1",
+            "-segment_list_type", "flat",
+            f"{chunkFolder}/source_%03d.mp4"
+        ]
+        segmentList = subprocess.run(splitCommand, check=True, capture_output=True, text=True).stdout
+
+        # zoompan emits one frame per input frame and counts its time at 30 fps, so a chunk's time offset comes from
+        # the frames before it rather than from the container timestamps, which B-frame delays shift
+        sourceChunks = []
+        framesBefore = 0
+        for line in segmentList.splitlines():
+            chunkName = os.path.basename(line.strip())
+            if not chunkName:
+                continue
+            sourceChunks.append((chunkName, framesBefore / 30))
+            cap = cv2.VideoCapture(f"{chunkFolder}/{chunkName}")
+            framesBefore += int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+
+        # Every chunk gets the same zoom start and its own time offset, so the time dependent filters line up with
+        # a single pass encode
+        zoomStart = getZoomStart(videoDimensions)
+        chunkThreads = max(1, (threads or FFMPEG_THREADS) // len(sourceChunks))
+        # Created here since the chunk encoder threads don't see the current task
+        reporter = ProgressReporter("encode", framesBefore)
+
+        def encodeChunk(sourceChunk):
+            chunkName, startTime = sourceChunk
+            ffmpegCommand = [
+                "ffmpeg", "-y", "-i", f"{chunkFolder}/{chunkName}",
+                "-vf", getVideoFilters(videoDimensions, processingSpecs, startTime, zoomStart),
+                *getVideoCodecArgs(),
+                "-an",
+                "-threads", str(chunkThreads),
+                f"{chunkFolder}/encoded_{chunkName}"
+            ]
+            runFfmpegWithProgress(ffmpegCommand, reporter, chunkName)
+            return f"encoded_{chunkName}"
+
+        with ThreadPoolExecutor(max_workers=chunks) as executor:
+            encodedChunks = list(executor.map(encodeChunk, sourceChunks))
+
+        concatList = f"{chunkFolder}/chunks.txt"
+        with open(concatList, "w") as writer:
+            for encodedChunk in encodedChunks:
+                writer.write(f"file '{encodedChunk}'\n")
+
+        # The encoded chunks are joined without re-encoding, audio and metadata are added in the same pass
+        audioInput, audioMap = getAudioInputArgs(audioFile, 1)
+        ffmpegCommand = [
+            "ffmpeg", "-y",
+            "-f", "concat", "-safe", "0", "-i", concatList,
+            *audioInput,
+            *(audioMap or ["-map", "0:v:0"]),
+            "-c:v", "copy",
+            *getMuxArgs(),
+            "-shortest",
+            outputVideo
+        ]
+        subprocess.run(ffmpegCommand, check=True, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(chunkFolder, ignore_errors=True)
+
+
+def streamFramesToFfmpeg(inputVideo, branches, workers=None):
+    cap = cv2.VideoCapture(inputVideo)
+    frameWidth = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frameHeight = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = probeMedia(inputVideo).fps or cap.get(cv2.CAP_PROP_FPS)
+    audioInput, audioMap = getAudioInputArgs(getSourceAudio(inputVideo), 1)
+
+    # Every branch is a (frameTransform, encodeArgs) pair with its own ffmpeg encoder. Raw BGR frames go over stdin,
+    # the encoded source audio is stream copied in the same invocation
+    encoders = []
+    for frameTransform, encodeArgs in branches:
+        ffmpegCommand = [
+            "ffmpeg", "-y",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "-s", f"{frameWidth}x{frameHeight}",
+            "-r", str(fps),
+            "-i", "pipe:0",
+            *audioInput,
+            *(audioMap or ["-map", "0:v:0"]),
+            "-shortest",
+            *encodeArgs
+        ]
+        ffmpegLog = tempfile.TemporaryFile()
+        process = subprocess.Popen(ffmpegCommand, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=ffmpegLog)
+        encoders.append({"transform": frameTransform, "command": ffmpegCommand, "process": process, "log": ffmpegLog, "open": True})
+
+    def transformBranches(frame, frameHeight, frameWidth):
+        # Frames are decoded once and handed to every branch, all but the last one get their own copy
+        # since the transforms modify frames in place
+        branchFrames = []
+        for index, encoder in enumerate(encoders):
+            branchFrame = frame if index == len(encoders) - 1 else frame.copy()
+            branchFrames.append(encoder["transform"](branchFrame, frameHeight, frameWidth))
+        return branchFrames
+
+    def writeBranches(branchFrames):
+        for encoder, branchFrame in zip(encoders, branchFrames):
+            if not encoder["open"]:
+                continue
+            try:
+                encoder["process"].stdin.write(branchFrame.data)
+            except BrokenPipeError:
+                encoder["open"] = False # FFmpeg exited early, its return code and log are reported below
+        return any(encoder["open"] for encoder in encoders)
+
+    framesProcessed = 0
+    try:
+        framesProcessed = processFrames(cap, transformBranches, writeBranches, workers, "render")
+    finally:
+        cap.release()
+        for encoder in encoders:
+            try:
+                encoder["process"].stdin.close()
+            except BrokenPipeError:
+                pass
+        incrementMetric("frames_processed_total", framesProcessed * len(encoders), {"stage": "pixels"})
+
+    failure = None
+    for encoder in encoders:
+        returnCode = encoder["process"].wait()
+        if returnCode != 0 and failure is None:
+            encoder["log"].seek(0)
+            stderr = encoder["log"].read().decode("utf-8", errors="replace")
+            print("FFmpeg error:", stderr)
+            failure = subprocess.CalledProcessError(returnCode, encoder["command"], stderr=stderr)
+        encoder["log"].close()
+    if failure is not None:
+        raise failure
+
+
+def getPixelsTransform(variantId, swapSides=False):
+    def transform(frame, frameHeight, frameWidth):
+        frame = deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, variantId)
+        if swapSides:
+            frame = swapVideoSidesInFrame(frame, frameHeight, frameWidth)
+        return frame
+    return transform
+
+
+def processVideo(processedVideos, fileName, processingSpecs, threads=None):
+    variantId = processingSpecs["VariantId"]
+    inputVideo = f"{processedVideos}/{fileName}.mp4"
+    outputVideo = f"{processedVideos}/{fileName}_{variantId}.mov"
+    swapSides = processingSpecs.get("SwapSides", False)
+
+    # The effects are part of the encode filtergraph, the variant takes one decode and one encode
+    if PIXEL_EFFECT_MODE == "ffmpeg":
+        encodeVideo(inputVideo, getVideoInfo(inputVideo), processingSpecs, outputVideo, threads, getSourceAudio(inputVideo))
+        return fileName
+
+    if STREAM_FRAMES:
+        renderVariantGroup(processedVideos, fileName, [processingSpecs], threads)
+        return fileName
+
+    pixelsFileName = deleteRandomPixels(processedVideos, fileName, variantId)
+    pixelsVideo = f"{processedVideos}/{pixelsFileName}.mp4"
+    if swapSides:
+        swappedFileName = swapVideoSides(processedVideos, pixelsFileName, getSourceAudio(inputVideo))
+        removeFile(pixelsVideo)
+        pixelsVideo = f"{processedVideos}/{swappedFileName}.mp4"
+
+    videoDimensions = getVideoInfo(pixelsVideo)
+    # bitrate = getVideoBitrate(pixelsVideo)
+    # print(bitrate)
+    # bitrateKbps = f"{(bitrate) // 1000}k"
+    # print(bitrateKbps)
+
+    encodeVideo(pixelsVideo, videoDimensions, processingSpecs, outputVideo, threads, getSourceAudio(inputVideo))
+    removeFile(pixelsVideo)
     return fileName
 
 
-def addDataToAirTable(newRecordData):
+def renderVariantGroup(processedVideos, fileName, processingSpecs, threads=None):
+    if not STREAM_FRAMES or PIXEL_EFFECT_MODE == "ffmpeg":
+        for specs in processingSpecs:
+            processVideo(processedVideos, fileName, specs, threads)
+        return [specs["VariantId"] for specs in processingSpecs]
+
+    # Source is probed and decoded once, every variant gets its own transform and encoder branch
+    inputVideo = f"{processedVideos}/{fileName}.mp4"
+    videoDimensions = getVideoInfo(inputVideo)
+
+    # Chunked encoding needs the pixel pass on disk to cut it at keyframes, the branches then write lossless
+    # intermediates that are encoded in chunks afterwards
+    chunked = getEncodeChunkCount(videoDimensions["duration"]) > 1
+    pixelsVideos = [f"{processedVideos}/{fileName}_{specs['VariantId']}_pixels.mp4" for specs in processingSpecs]
+
+    # The encoders of the group split its ffmpeg thread budget
+    encoderThreads = max(1, (threads or FFMPEG_THREADS) // len(processingSpecs))
+    branches = []
+    for specs, pixelsVideo in zip(processingSpecs, pixelsVideos):
+        outputVideo = f"{processedVideos}/{fileName}_{specs['VariantId']}.mov"
+        encodeArgs = getLosslessEncodeArgs(pixelsVideo, encoderThreads) if chunked else getEncodeArgs(videoDimensions, specs, outputVideo, encoderThreads)
+        branches.append((getPixelsTransform(specs["VariantId"], specs.get("SwapSides", False)), encodeArgs))
+    try:
+        streamFramesToFfmpeg(inputVideo, branches, threads)
+        if chunked:
+            for specs, pixelsVideo in zip(processingSpecs, pixelsVideos):
+                outputVideo = f"{processedVideos}/{fileName}_{specs['VariantId']}.mov"
+                encodeVideo(pixelsVideo, videoDimensions, specs, outputVideo, threads, getSourceAudio(inputVideo))
+    finally:
+        if chunked:
+            for pixelsVideo in pixelsVideos:
+                removeFile(pixelsVideo)
+    return [specs["VariantId"] for specs in processingSpecs]
+
+
+def renderVariantGroupWorker(args):
+    return renderVariantGroup(*args)
+
+
+def initVariantWorker():
+    global progressEnabled
+    progressEnabled = False
+    np.random.seed()
+    random.seed()
+
+
+def processVideoVariants(processedVideos, fileName, processingSpecs, onRendered=None):
+    numWorkers = max(1, min(VARIANT_WORKERS, len(processingSpecs)))
+    if numWorkers == 1:
+        variantIds = renderVariantGroup(processedVideos, fileName, processingSpecs)
+        if onRendered is not None:
+            onRendered(variantIds)
+        return fileName
+
+    # Variants are dealt round robin to the pool processes, each process still decodes the source once for its group.
+    # billiard is used instead of multiprocessing because prefork Celery workers are daemonic and may not start children
+    # through multiprocessing. numpy's and Python's random states are reseeded since forked children would otherwise
+    # share them. The children inherit the current task from the fork, progress stays with the task process
+    # The audio is encoded before the pool starts so the processes share it instead of each encoding their own
+    getSourceAudio(f"{processedVideos}/{fileName}.mp4")
+    variantGroups = [processingSpecs[index::numWorkers] for index in range(numWorkers)]
+    groupThreads = max(1, FFMPEG_THREADS // numWorkers)
+    with Pool(processes=numWorkers, initializer=initVariantWorker) as pool:
+        for variantIds in pool.imap_unordered(renderVariantGroupWorker, [(processedVideos, fileName, group, groupThreads) for group in variantGroups]):
+            print(f"Variants {variantIds} of {fileName} rendered")
+            if onRendered is not None:
+                onRendered(variantIds)
+    return fileName
 
-    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_ID_DRIVE}"
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-        "Content-Type": "application/json",
-    }
+
+def addDataToAirTable(newRecordData):
 
     records = []
     for variant in newRecordData["variantsList"]:
@@ -509,20 +1938,18 @@ def addDataToAirTable(newRecordData):
         }
         records.append(record)
 
-    payload = json.dumps({"records": records})
-
+    createdRecords = []
     try:
-        response = requests.request("POST", url, headers=headers, data=payload)
-        if response.status_code == 429: # Request rate limit case
-            time.sleep(30)
-            response = requests.request("POST", url, headers=headers, data=payload)
-        response.raise_for_status()
+        for recordsBatch in getAirtableBatches(records):
+            response = airtableRequest("POST", AIRTABLE_TABLE_ID_DRIVE, payload={"records": recordsBatch})
 
-        data = response.json()
+            data = response.json()
+            createdRecords.extend(data.get("records", []))
+        return createdRecords
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error: {e}")
-        print(f"Response content: {response.text}")
+        print(f"Response content: {e.response.text}")
         return []
 
     except requests.exceptions.RequestException as e:
@@ -531,40 +1958,119 @@ def addDataToAirTable(newRecordData):
 
 
 def updateRecordStatus(data, filterColumns):
-    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_ID}/{data['recordId']}"
-    headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}", 'Content-Type': 'application/json',}
-
     columnNames = list(filterColumns.keys())
 
     fields = {}
     for columnName in columnNames:
         fields[columnName] = filterColumns[columnName]
 
-    payload = json.dumps({"fields": fields})
+    payload = {"fields": fields}
 
     try:
-        response = requests.request("PATCH", url, headers=headers, data=payload)
-        if response.status_code == 429: # Request rate limit case
-            time.sleep(30)
-            response = requests.request("PATCH", url, headers=headers, data=payload)
-        response.raise_for_status()
+        airtableRequest("PATCH", f"{AIRTABLE_TABLE_ID}/{data['recordId']}", payload=payload)
         return True
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error: {e}")
-        print(f"Response content: {response.text}")
+        print(f"Response content: {e.response.text}")
         return False
 
 
-def getProcessingSpecs():
-    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{AIRTABLE_SPECS_TABLE_ID}"
-    headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}"}
+def getAirtableBatches(records):
+    # Airtable creates or updates at most 10 records per request
+    for index in range(0, len(records), AIRTABLE_BATCH_SIZE):
+        yield records[index:index + AIRTABLE_BATCH_SIZE]
+
+
+def updateRecordsStatus(recordIds, filterColumns, tableId=None):
+    records = [{"id": recordId, "fields": dict(filterColumns)} for recordId in recordIds]
+    return updateRecords(records, tableId or AIRTABLE_TABLE_ID)
 
+
+def updateRecords(records, tableId, failedRecords=None):
+    allUpdated = True
+    for recordsBatch in getAirtableBatches(records):
+        try:
+            airtableRequest("PATCH", tableId, payload={"records": recordsBatch})
+            continue
+        except requests.exceptions.HTTPError as e:
+            print(f"HTTP Error: {e}")
+            print(f"Response content: {e.response.text}")
+        except requests.exceptions.RequestException as e:
+            print(f"Request Exception: {e}")
+        allUpdated = False
+        if failedRecords is not None:
+            failedRecords.extend(recordsBatch)
+    return allUpdated
+
+
+class StatusUpdateBuffer:
+    """Collects record status updates of a worker process and writes them in multi-record PATCHes.
+
+    A full batch is written right away, anything smaller after flushInterval seconds, when the worker process shuts
+    down or at exit. Updates for the same record are merged.
+    """
+
+    def __init__(self, tableId, flushInterval):
+        self.tableId = tableId
+        self.flushInterval = flushInterval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, recordId, fields):
+        with self.lock:
+            self.pending.setdefault(recordId, {}).update(fields)
+            isFull = len(self.pending) >= AIRTABLE_BATCH_SIZE
+            if not isFull:
+                self.startTimer()
+        if isFull:
+            self.flush()
+
+    def startTimer(self):
+        if self.timer is None:
+            self.timer = threading.Timer(self.flushInterval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            records = [{"id": recordId, "fields": fields} for recordId, fields in self.pending.items()]
+            self.pending = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        failedRecords = []
+        if not records or updateRecords(records, self.tableId, failedRecords):
+            return
+
+        # Failed updates go back into the buffer for the next flush, fields added since then win
+        print(f"Could not update status of records, retrying in {self.flushInterval}s: {[record['id'] for record in failedRecords]}")
+        with self.lock:
+            for record in failedRecords:
+                self.pending[record["id"]] = {**record["fields"], **self.pending.get(record["id"], {})}
+            self.startTimer()
+
+
+def getStatusUpdateBuffer(tableId=None):
+    tableId = tableId or AIRTABLE_TABLE_ID
+    with statusUpdateBuffersLock:
+        if tableId not in statusUpdateBuffers:
+            statusUpdateBuffers[tableId] = StatusUpdateBuffer(tableId, AIRTABLE_FLUSH_INTERVAL)
+        return statusUpdateBuffers[tableId]
+
+
+@worker_process_shutdown.connect
+def flushStatusUpdates(**kwargs):
+    for statusUpdateBuffer in list(statusUpdateBuffers.values()):
+        statusUpdateBuffer.flush()
+
+
+atexit.register(flushStatusUpdates)
+
+
+def getProcessingSpecs():
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 429: # Request rate limit case
-            time.sleep(30)
-            response = requests.get(url, headers=headers)
-        response.raise_for_status()
+        response = airtableRequest("GET", AIRTABLE_SPECS_TABLE_ID)
 
         data = response.json()
         specsInfo =  data.get("records", [])
@@ -577,45 +2083,200 @@ def getProcessingSpecs():
         return None
 
 
-@celery.task()
-def processVideoTask(record, processedVideos, processingSpecs):
-    recordId = record["id"]
-    recordFields = record["fields"]
-    variationFolderId = recordFields["drive folder Variations (from Model)"][0]
-    originalFileName = downloadVideo(recordFields["Google Drive URL"], processedVideos, recordId)
+def newVariant(specs):
+    randomNumber = random.randint(1000, 9999)
+    variant = {
+        "variantId": specs["VariantId"],
+        "fileUrl": None,
+        "fileName": f"IMG_{randomNumber}.MOV",
+        "randomNumber": randomNumber
+    }
+    return variant
 
-    variantsList = []
-    # processingSpecs = [processingSpecs[3]]
-    for specs in processingSpecs:
-        fileName = processVideo(processedVideos, originalFileName, specs)
 
-        randomNumber = random.randint(1000, 9999)
-        fileUrl = uploadToDrive(f"{processedVideos}/{fileName}_{specs['VariantId']}.mov", f"IMG_{randomNumber}.MOV", variationFolderId)
+def uploadVariant(processedVideos, fileName, specs, variationFolderId):
+    variant = newVariant(specs)
+    variant["fileUrl"] = uploadToDrive(f"{processedVideos}/{fileName}_{specs['VariantId']}.mov", variant["fileName"], variationFolderId)
+    return variant
 
-        variant = {
-            "variantId": specs["VariantId"],
-            "fileUrl": fileUrl,
-            "fileName": f"IMG_{randomNumber}.MOV",
-            "randomNumber": randomNumber
-        }
-        variantsList.append(variant)
 
+def saveVariants(record, variantsList):
+    recordId = record["id"]
     newRecordData = {
         "recordId": recordId,
         "tiktokUrl": record["fields"]["Video URL"],
         "soundUrl": record["fields"]["short sound url"],
         "variantsList": variantsList,
-        "DriveId": variationFolderId
+        "DriveId": record["fields"]["drive folder Variations (from Model)"][0]
     }
 
-    addDataToAirTable(newRecordData)
-    status = updateRecordStatus({"recordId": recordId}, {"Video Processed": True, "Processing In Progress": False})
-    if not status:
-        print(f"Could not update status in linked table for record: {recordId}")
+    # Raised so the task retries, the uploaded variants come from the checkpoint and only this step is repeated
+    if not addDataToAirTable(newRecordData):
+        raise RuntimeError(f"Could not add the variants of {recordId} to Airtable")
+    getStatusUpdateBuffer().add(recordId, {"Video Processed": True, "Processing In Progress": False})
+
+
+def downloadRecordSource(record, processedVideos, checkpoint):
+    fileName = checkpoint.get("downloaded")
+    if fileName is not None and os.path.exists(f"{processedVideos}/{fileName}.mp4"):
+        return fileName
+    with timedStage("download"):
+        fileName = downloadVideo(record["fields"]["Google Drive URL"], processedVideos, record["id"])
+    saveCheckpoint(record["id"], "downloaded", fileName)
+    return fileName
+
+
+# Retried with backoff on any error, the checkpoint makes a retry repeat only the steps that didn't finish
+retryOptions = {
+    "autoretry_for": (Exception,),
+    "retry_backoff": True,
+    "retry_backoff_max": TASK_RETRY_BACKOFF_MAX,
+    "retry_jitter": True,
+    "max_retries": TASK_MAX_RETRIES,
+}
+
+
+@celery.task(**retryOptions)
+def processVideoTask(record, processedVideos, processingSpecs):
+    recordId = record["id"]
+    recordFields = record["fields"]
+    variationFolderId = recordFields["drive folder Variations (from Model)"][0]
+    checkpoint = getCheckpoint(recordId)
+    originalFileName = recordId # downloadVideo names the source after the record
+
+    if VARIANT_DISPATCH == "chord":
+        # Every variant task fetches the source on its own host and removes it there once done
+        variantHeaders = getBatchChordHeaders(processVideoTask, recordId, "variant")
+        finalHeaders = getBatchChordHeaders(processVideoTask, recordId, "final")
+        variantTasks = [processVariantTask.s(record, processedVideos, originalFileName, specs).set(headers=variantHeaders) for specs in processingSpecs]
+        chord(variantTasks)(saveVariantsTask.s(record, processedVideos, originalFileName).set(headers=finalHeaders))
+        return
+
+    # Every variant is handed to the upload queue as soon as it is rendered, the .mov is removed once it is on Drive.
+    # Variants uploaded by an earlier attempt keep their name and URL, rendered ones still on disk are only uploaded
+    uploads = UploadQueue()
+    uploadFutures = {}
+    variantsList = [checkpoint.get(f"uploaded:{specs['VariantId']}") or newVariant(specs) for specs in processingSpecs]
+
+    def queueUploads(variantIds):
+        for variant in variantsList:
+            if variant["variantId"] in variantIds:
+                saveCheckpoint(recordId, f"rendered:{variant['variantId']}")
+                filePath = f"{processedVideos}/{originalFileName}_{variant['variantId']}.mov"
+                saveUploadCheckpoint = lambda fileUrl, variant=variant: saveCheckpoint(recordId, f"uploaded:{variant['variantId']}", {**variant, "fileUrl": fileUrl})
+                uploadFutures[variant["variantId"]] = uploads.submit(filePath, variant["fileName"], variationFolderId, onUploaded=saveUploadCheckpoint)
+
+    pendingSpecs = []
+    renderedVariantIds = []
+    for specs, variant in zip(processingSpecs, variantsList):
+        if variant["fileUrl"] is not None:
+            continue
+        if checkpoint.get(f"rendered:{specs['VariantId']}") and os.path.exists(f"{processedVideos}/{originalFileName}_{specs['VariantId']}.mov"):
+            renderedVariantIds.append(specs["VariantId"])
+        else:
+            pendingSpecs.append(specs)
+
+    # processingSpecs = [processingSpecs[3]]
+    try:
+        queueUploads(renderedVariantIds)
+        if pendingSpecs:
+            downloadRecordSource(record, processedVideos, checkpoint)
+            with timedStage("render"):
+                processVideoVariants(processedVideos, originalFileName, pendingSpecs, onRendered=queueUploads)
+    finally:
+        removeFile(f"{processedVideos}/{originalFileName}_audio.m4a")
+        with timedStage("upload_wait"):
+            uploads.wait()
 
     for variant in variantsList:
-        filePath = f"{processedVideos}/{fileName}_{variant['variantId']}.mov"
-        removeFile(filePath)
+        if variant["variantId"] in uploadFutures:
+            variant["fileUrl"] = uploadFutures[variant["variantId"]].result()
+
+    with timedStage("airtable"):
+        saveVariants(record, variantsList)
+    clearCheckpoint(recordId)
+
+
+@celery.task(**retryOptions)
+def processVariantTask(record, processedVideos, fileName, specs):
+    recordId = record["id"]
+    variantId = specs["VariantId"]
+    checkpoint = getCheckpoint(recordId)
+    variant = checkpoint.get(f"uploaded:{variantId}")
+    if variant is not None:
+        return variant
+
+    # Variant tasks can land on any worker sharing the broker, the source is fetched again if this host doesn't have
+    # it and removed from the host once its last variant task there has uploaded
+    filePath = f"{processedVideos}/{fileName}_{variantId}.mov"
+    checkDir(processedVideos)
+    with sharedSource(processedVideos, fileName):
+        if not (checkpoint.get(f"rendered:{variantId}") and os.path.exists(filePath)):
+            downloadRecordSource(record, processedVideos, checkpoint)
+            with timedStage("render"):
+                renderVariantGroup(processedVideos, fileName, [specs])
+            saveCheckpoint(recordId, f"rendered:{variantId}")
+
+        variationFolderId = record["fields"]["drive folder Variations (from Model)"][0]
+        variant = uploadVariant(processedVideos, fileName, specs, variationFolderId)
+        saveCheckpoint(recordId, f"uploaded:{variantId}", variant)
+    removeFile(filePath)
+    return variant
+
+
+@celery.task(**retryOptions)
+def saveVariantsTask(variantsList, record, processedVideos, fileName):
+    with timedStage("airtable"):
+        saveVariants(record, variantsList)
+    removeSourceFiles(processedVideos, fileName)
+    clearCheckpoint(record["id"])
+
+
+def enqueueBatchPage(batchId, signatures):
+    # The page goes out as one group, published over a single producer connection instead of a .delay per record
+    updateBatch(batchId, {"pages": 1, "enqueued": len(signatures)})
+    group([signature.set(headers={"batchId": batchId}) for signature in signatures]).apply_async()
+    print(f"Batch {batchId}: {len(signatures)} tasks enqueued")
+
+
+@celery.task()
+def enqueueProcessingBatch(batchId, processedVideos, processingSpecs):
+    offset = None
+    firstRequest = True
+    try:
+        while offset is not None or firstRequest:
+            data = getAirtableRecords(offset, AIRTABLE_TABLE_ID, AIRTABLE_VIEW_ID, {"Video Processed": False,  "Processing In Progress": False})
+            records = data.get("records")
+            offset = data.get("offset")
+
+            if records:
+                updateRecordsStatus([record["id"] for record in records], {"Processing In Progress": True})
+                enqueueBatchPage(batchId, [processVideoTask.s(record, processedVideos, processingSpecs) for record in records])
+            firstRequest = False
+    except Exception:
+        updateBatch(batchId, state="failed")
+        raise
+    updateBatch(batchId, state="enqueued")
+
+
+@celery.task()
+def enqueueSplitBatch(batchId, processedVideos):
+    offset = None
+    firstRequest = True
+    try:
+        while offset is not None or firstRequest:
+            data = getAirtableRecords(offset, AIRTABLE_LONG_FORMAT_TABLE_ID, AIRTABLE_LONG_FORMAT_VIEW_ID, {"Processed": False}) # Getting data of long format videos
+            records = data.get("records")
+            offset = data.get("offset")
+
+            records = [record for record in records or [] if record["fields"].get("drive folder LongFormat") is not None]
+            if records:
+                enqueueBatchPage(batchId, [processLongVideos.s(record, processedVideos) for record in records])
+            firstRequest = False
+    except Exception:
+        updateBatch(batchId, state="failed")
+        raise
+    updateBatch(batchId, state="enqueued")
 
 
 @app.route('/')
@@ -635,23 +2296,12 @@ def startProcessing():
             if processingSpecs is None:
                 return jsonify({"status": 500, "message": "Error getting processing specs, please try again"})
 
-    offset = None
-    firstRequest = True
-    while offset is not None or firstRequest:
-        data = getAirtableRecords(offset, AIRTABLE_TABLE_ID, AIRTABLE_VIEW_ID, {"Video Processed": False,  "Processing In Progress": False})
-        records = data.get("records")
-        offset = data.get("offset")
-        print("Records to Process")
-        print(json.dumps(records))
-
-        if records:
-            for record in records:
-                updateRecordStatus({"recordId": record["id"]}, {"Processing In Progress": True})
-                processVideoTask.delay(record, processedVideos, processingSpecs)
-                # processVideoTask(record, processedVideos, processingSpecs)
-        firstRequest = False
-
-    return jsonify({"status": 200, "message": "Processing started!!"})
+    # Paging through Airtable happens in a worker, the request only starts the batch
+    batchId = str(uuid.uuid4())
+    createBatch(batchId, "process")
+    enqueueProcessingBatch.delay(batchId, processedVideos, processingSpecs)
+
+    return jsonify({"status": 200, "message": "Processing started!!", "batchId": batchId})
 
 @celery.task()
 def downloadSingleVideo(processedVideos, data):
@@ -661,10 +2311,48 @@ def downloadSingleVideo(processedVideos, data):
 
     videoSpec["VariantId"] = "Processed"
 
-    fileName = downloadVideo(videoUrl, processedVideos, uuidString)
-    processVideo(processedVideos, fileName, videoSpec)
-    originalFilePath = f"{processedVideos}/{fileName}.mp4"
-    removeFile(originalFilePath)
+    with timedStage("download"):
+        fileName = downloadVideo(videoUrl, processedVideos, uuidString)
+    with timedStage("render"):
+        processVideo(processedVideos, fileName, videoSpec)
+    removeSourceFiles(processedVideos, fileName)
+    removeExpiredResults(processedVideos)
+
+
+def removeExpiredResults(folderName):
+    # Results are kept for RESULT_TTL_SECONDS so clients can resume and fetch ranges, anything older is removed
+    # whenever a job starts or finishes
+    expiresBefore = time.time() - RESULT_TTL_SECONDS
+    for fileName in os.listdir(folderName):
+        filePath = f"{folderName}/{fileName}"
+        try:
+            if fileName.endswith("_Processed.mov") and os.path.getmtime(filePath) < expiresBefore:
+                removeFile(filePath)
+        except OSError as e:
+            print(f"Error removing expired result {filePath}: {e}")
+
+
+def sendResult(processedVideos, taskId):
+    # Conditional responses answer Range requests with 206 and If-None-Match with 304, so clients can resume,
+    # seek and download in parallel ranges
+    filePath = f"{processedVideos}/{taskId}_Processed.mov"
+    if not os.path.exists(filePath):
+        return None
+    return send_file(os.path.abspath(filePath), mimetype='video/mp4', conditional=True, etag=True, max_age=RESULT_TTL_SECONDS)
+
+
+@app.route('/processSingleVideo/<taskId>', methods=['GET', 'HEAD'])
+def processSingleVideoResult(taskId):
+    # Until the task succeeded the file is missing, still being encoded or left partial by a failed attempt
+    status = AsyncResult(taskId).status
+    if status in ("PENDING", "STARTED", "RETRY", "PROGRESS"):
+        return jsonify({"status": 202, "state": status, "message": "Processing in progress. Please wait :)"}), 202
+    if status != "SUCCESS":
+        return jsonify({"status": 404, "state": status, "message": "Result not found"}), 404
+    response = sendResult("ProcessSingleVideo", os.path.basename(taskId))
+    if response is None:
+        return jsonify({"status": 404, "message": "Result not found or expired"}), 404
+    return response
 
 
 @app.route('/processSingleVideo', methods=['POST'])
@@ -680,20 +2368,13 @@ def processSingleVideo():
         taskResult = AsyncResult(taskId)
         status = taskResult.status
         if status == "SUCCESS":
-            filePath = f"{processedVideos}/{taskId}_Processed.mov"
-            if not os.path.exists(filePath):
+            response = sendResult(processedVideos, os.path.basename(taskId))
+            if response is None:
                 return "Error processing. Ask developer :)"
+            return response
 
-            @after_this_request
-            def removeFile(response):
-                try:
-                    os.remove(filePath)
-                    print(f"File removed: {filePath}")
-                except Exception as error:
-                    print(f"Error removing file: {error}")
-                return response
-            return send_file(filePath, mimetype='video/mp4')
-
+        elif status == "PROGRESS":
+            return jsonify({"status": 200, "state": status, "progress": taskResult.info})
         elif status == "FAILURE":
             return "Error processing. Ask developer :)"
         elif status == "PENDING":
@@ -701,6 +2382,7 @@ def processSingleVideo():
         else:
             return "Unexpected behaviour. Please wait :)"
 
+    removeExpiredResults(processedVideos)
     uuId = str(uuid.uuid4())
     data["taskId"] = uuId
 
@@ -709,47 +2391,134 @@ def processSingleVideo():
     return taskId
 
 
+def downloadDriveFile(mediaRequest, filePath, chunkSize=None):
+    # Chunks are requested by byte range and written straight to disk, so memory use is bounded by the chunk size.
+    # A chunk is only written once it arrived completely, after a transient failure the download resumes at the
+    # current end of the file. A file left by an earlier attempt is appended to, so a retried task resumes it too
+    chunkSize = chunkSize or DRIVE_DOWNLOAD_CHUNK_SIZE
+    totalSize = None
+    failedAttempts = 0
+
+    with open(filePath, "ab") as writer:
+        if writer.tell() > 0:
+            print(f"Download {filePath}: resuming at byte {writer.tell()}")
+        while totalSize is None or writer.tell() < totalSize:
+            start = writer.tell()
+            headers = dict(mediaRequest.headers)
+            headers["range"] = f"bytes={start}-{start + chunkSize - 1}"
+
+            try:
+                response, content = mediaRequest.http.request(mediaRequest.uri, method="GET", headers=headers)
+            except (httplib2.HttpLib2Error, OSError) as e:
+                response, content = None, None
+                print(f"Download {filePath} interrupted at byte {start}: {e}")
+
+            if response is not None and response.status == 200: # Range ignored, whole file in one response
+                writer.truncate(0)
+                writer.write(content)
+                break
+            if response is not None and response.status == 206:
+                writer.write(content)
+                contentRange = response.get("content-range", "")
+                if contentRange.split("/")[-1].isdigit():
+                    totalSize = int(contentRange.split("/")[-1])
+                    print(f"Download {filePath}: {int(writer.tell() / totalSize * 100)}%.")
+                elif len(content) < chunkSize:
+                    break
+                # A chunk that came back empty or short of both the range and the file end counts as a failed attempt,
+                # otherwise a stalled transfer would be requested again forever
+                expectedSize = chunkSize if totalSize is None else min(chunkSize, totalSize - start)
+                if len(content) >= expectedSize:
+                    failedAttempts = 0
+                    continue
+            if response is not None and response.status == 416: # Nothing left past the requested offset
+                break
+            if response is not None and response.status not in (206, 429) and response.status < 500:
+                raise HttpError(response, content, uri=mediaRequest.uri)
+
+            failedAttempts += 1
+            if failedAttempts > DRIVE_DOWNLOAD_RETRIES:
+                raise IOError(f"Download {filePath} failed at byte {start} after {DRIVE_DOWNLOAD_RETRIES} retries")
+            time.sleep(min(2 ** failedAttempts, 60))
+    incrementMetric("bytes_total", os.path.getsize(filePath), {"direction": "download", "target": "drive"})
+    return filePath
+
+
 def downloadVideoAuth(processedVideos, fileId, fileName):
     try:
         fileExtension = fileName.split(".")[-1]
         fileName = f"{fileId}.{fileExtension}"
         filePath = f"{processedVideos}/{fileName}"
 
-        SERVICE_ACCOUNT_FILE = "creds.json"
-        SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
-
-        userAccountEmail = USER_ACCOUNT_EMAIL
-        credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES, subject=userAccountEmail)
-        service = build("drive", "v3", credentials=credentials)
+        service = getDriveService(["https://www.googleapis.com/auth/drive.readonly"])
 
         request = service.files().get_media(fileId=fileId)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print(f"Download {filePath}: {int(status.progress() * 100)}%.")
-        
-        with open(filePath, 'wb') as f:
-            f.write(fh.getvalue())
+        getCachedSource(f"drive:{fileId}", filePath, lambda downloadPath: downloadDriveFile(request, downloadPath))
         return fileName
     except Exception as e:
         print(f"An error occurred while downloading {filePath}: {e}")
 
 
-def splitVideo(folderName, fileName, splitLength):
+def splitVideo(folderName, fileName, splitLength, onSplit=None, mode=None):
     filePath = f"{folderName}/{fileName}"
     fileExtension = fileName.split(".")[-1]
     fileName = fileName.split(".")[0]
+    mode = mode or SPLIT_MODE
+
+    if mode == "seek":
+        return splitVideoBySeeking(folderName, filePath, fileName, fileExtension, splitLength, onSplit)
+
+    # All clips come out of one pass through the segment muxer. Stream copy can only cut on existing keyframes, so
+    # clip lengths follow the source GOP. The accurate mode re-encodes the video with a keyframe forced on every
+    # boundary, the delta absorbs the rounding between forced keyframe times and the segment times
+    if mode == "accurate":
+        codecArgs = [
+            "-c:v", "libx264", "-preset", "medium", "-crf", "18",
+            "-force_key_frames", f"expr:gte(t,n_forced*{splitLength})",
+            "-threads", str(FFMPEG_THREADS),
+            "-c:a", "copy",
+            "-segment_time_delta", "0.05",
+        ]
+    else:
+        codecArgs = ["-c", "copy"]
 
-    ffprobeCommand = [
-        "ffprobe", "-v", "error", "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1", filePath
+    ffmpegCommand = [
+        "ffmpeg", "-y", "-i", filePath,
+        *codecArgs,
+        "-f", "segment",
+        "-segment_time", str(splitLength),
+        "-reset_timestamps", "1",
+        "-segment_list", "pipe:1",
+        "-segment_list_type", "flat",
+        f"{folderName}/{fileName}_%03d.{fileExtension}"
     ]
-    output = subprocess.check_output(ffprobeCommand).decode("utf-8").strip()
-    duration = float(output)
+
+    # The muxer prints every clip to the segment list once it is closed, so clips are handed over while the rest
+    # of the file is still being cut
+    splittedVideos = []
+    mediaInfo = probeMedia(filePath)
+    reporter = ProgressReporter("split", getFrameCount(filePath))
+    process = subprocess.Popen(ffmpegCommand, stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        splittedFileName = os.path.basename(line.strip())
+        if not splittedFileName:
+            continue
+        splittedVideos.append(splittedFileName)
+        reporter.update(int(min(mediaInfo.duration, len(splittedVideos) * splitLength) * mediaInfo.fps))
+        if onSplit is not None:
+            onSplit(splittedFileName)
+    returnCode = process.wait()
+    if returnCode != 0:
+        raise subprocess.CalledProcessError(returnCode, ffmpegCommand)
+    return splittedVideos
+
+
+def splitVideoBySeeking(folderName, filePath, fileName, fileExtension, splitLength, onSplit=None):
+    mediaInfo = probeMedia(filePath)
+    duration = mediaInfo.duration
 
     numSegments = math.ceil(duration / splitLength)
+    reporter = ProgressReporter("split", getFrameCount(filePath))
     splittedVideos = []
     for i in range(numSegments):
         startTime = i * splitLength
@@ -757,60 +2526,47 @@ def splitVideo(folderName, fileName, splitLength):
         splittedFileName = f"{fileName}_{i:03d}.{fileExtension}"
         splittedVideos.append(splittedFileName)
         outputFile = f"{folderName}/{splittedFileName}"
-        
+
+        # Seeking on the input side jumps straight to the cut point instead of reading the file up to it
         ffmpegCommand = [
-            "ffmpeg", "-i", filePath, "-ss", str(startTime),
+            "ffmpeg", "-y", "-ss", str(startTime), "-i", filePath,
             "-t", str(splitLength), "-c", "copy", outputFile
         ]
         subprocess.run(ffmpegCommand, check=True)
+        reporter.update(int(min(duration, startTime + splitLength) * mediaInfo.fps))
+        if onSplit is not None:
+            onSplit(splittedFileName)
     return splittedVideos
 
 
 def updateSplitRecordStatus(recordId):
-    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{AIRTABLE_LONG_FORMAT_TABLE_ID}/{recordId}"
-    headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}", 'Content-Type': 'application/json',}
-
-    payload = json.dumps({
+    payload = {
         "fields": {
             "Processed": True
         }
-    })
+    }
 
     try:
-        response = requests.request("PATCH", url, headers=headers, data=payload)
-        if response.status_code == 429: # Request rate limit case
-            time.sleep(30)
-            response = requests.request("PATCH", url, headers=headers, data=payload)
-        response.raise_for_status()
+        airtableRequest("PATCH", f"{AIRTABLE_LONG_FORMAT_TABLE_ID}/{recordId}", payload=payload)
         return True
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error: {e}")
-        print(f"Response content: {response.text}")
+        print(f"Response content: {e.response.text}")
         return False
 
 
-def addSplitDataToAirTable(newRecord):
-    url = f"{baseUrl}/{AIRTABLE_BASE_ID}/{AIRTABLE_SHORT_FORMAT_TABLE_ID}"
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    records = [{ "fields": newRecord}]
-    payload = json.dumps({"records": records})
+def addSplitDataToAirTable(newRecords):
+    records = [{ "fields": newRecord} for newRecord in newRecords]
 
     try:
-        response = requests.request("POST", url, headers=headers, data=payload)
-        if response.status_code == 429: # Request rate limit case
-            time.sleep(30)
-            response = requests.request("POST", url, headers=headers, data=payload)
-        response.raise_for_status()
+        for recordsBatch in getAirtableBatches(records):
+            response = airtableRequest("POST", AIRTABLE_SHORT_FORMAT_TABLE_ID, payload={"records": recordsBatch})
 
-        data = response.json()
+            data = response.json()
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error: {e}")
-        print(f"Response content: {response.text}")
+        print(f"Response content: {e.response.text}")
         return []
 
     except requests.exceptions.RequestException as e:
@@ -841,27 +2597,39 @@ def processLongVideos(record, processedVideos):
     else:
         splitLength = float(SPLIT_VIDEO_LENGTH)
 
-    downloadedFileName = downloadVideoAuth(processedVideos, fileId, fileName)
-
-    splittedVideos = splitVideo(processedVideos, downloadedFileName, splitLength)
-    os.remove(f"{processedVideos}/{downloadedFileName}")
+    with timedStage("download"):
+        downloadedFileName = downloadVideoAuth(processedVideos, fileId, fileName)
     fileNamePrefix = fileName.split(".")[0]
 
-    for video in splittedVideos:
-        filePath = f"{processedVideos}/{video}"
+    # Clips are uploaded in the background while the next ones are being cut, each one is removed once it is on Drive
+    uploads = UploadQueue()
+    clipUploads = []
+
+    def queueUpload(video):
         fileIndex = video.split(".")[0].split("_")[-1]
         fileExtension = video.split(".")[-1]
-        fileName = f"{fileNamePrefix}_{fileIndex}.{fileExtension}"
-        fileUrl = uploadToDrive(filePath, fileName, shortFormatFolder)
+        clipFileName = f"{fileNamePrefix}_{fileIndex}.{fileExtension}"
+        clipUploads.append((clipFileName, uploads.submit(f"{processedVideos}/{video}", clipFileName, shortFormatFolder)))
 
+    try:
+        with timedStage("split"):
+            splitVideo(processedVideos, downloadedFileName, splitLength, onSplit=queueUpload)
+        os.remove(f"{processedVideos}/{downloadedFileName}")
+    finally:
+        with timedStage("upload_wait"):
+            uploads.wait()
+
+    shortFormatRecords = []
+    for clipFileName, upload in clipUploads:
         shortFormatRecord = {
-            "Name": fileName,
-            "Google Drive URL": fileUrl,
+            "Name": clipFileName,
+            "Google Drive URL": upload.result(),
             "LongFormat": [recordId],
         }
-        addSplitDataToAirTable(shortFormatRecord)
-        removeFile(filePath)
-    updateSplitRecordStatus(recordId)
+        shortFormatRecords.append(shortFormatRecord)
+    with timedStage("airtable"):
+        addSplitDataToAirTable(shortFormatRecords)
+        updateSplitRecordStatus(recordId)
 
 
 @app.route('/splitVideos')
@@ -870,24 +2638,31 @@ def splitVideos():
 
     checkDir(processedVideos)
 
-    offset = None
-    firstRequest = True
-    while offset is not None or firstRequest:
-        data = getAirtableRecords(offset, AIRTABLE_LONG_FORMAT_TABLE_ID, AIRTABLE_LONG_FORMAT_VIEW_ID, {"Processed": False}) # Getting data of long format videos
-        records = data.get("records")
-        offset = data.get("offset")
-
-        print("Long videos")
-        print(json.dumps(records))
-
-        if records:
-            for record in records:
-                if record["fields"].get("drive folder LongFormat") is not None:
-                    processLongVideos.delay(record, processedVideos)
-                    # processLongVideos(record, processedVideos)
-        firstRequest = False
-
-    return jsonify({"status": 200, "message": "Processing started!!"})
+    batchId = str(uuid.uuid4())
+    createBatch(batchId, "split")
+    enqueueSplitBatch.delay(batchId, processedVideos)
+
+    return jsonify({"status": 200, "message": "Processing started!!", "batchId": batchId})
+
+
+@app.route('/batches/<batchId>')
+def batchStatus(batchId):
+    try:
+        batch = getBatch(batchId)
+    except redis.exceptions.RedisError as e:
+        return make_response(jsonify({"status": 503, "message": f"Batch store unavailable: {e}"}), 503)
+    if batch is None:
+        return make_response(jsonify({"status": 404, "message": "Unknown batch"}), 404)
+    return jsonify({"status": 200, **batch})
+
+
+@app.route('/metrics')
+def metrics():
+    try:
+        body = renderMetrics()
+    except redis.exceptions.RedisError as e:
+        return make_response(jsonify({"status": 503, "message": f"Metrics store unavailable: {e}"}), 503)
+    return Response(body, mimetype="text/plain; version=0.0.4")
 
 
 @app.route('/<path:path>')
@@ -0,0 +1,199 @@
+import argparse, json, os, platform, resource, shutil, subprocess, sys, time, random
+import multiprocessing
+from contextlib import redirect_stdout
+
+import cv2
+import numpy as np
+
+import app
+
+# Fixed specs shaped like the rows of the Airtable specs table, one per variant algorithm
+benchmarkSpecs = [
+    {"VariantId": 1, "RotationAngle": 2, "Contrast": 1.05, "Brightness": 0.02, "Saturation": 1.1, "Gamma": 1.0, "Mirror": True},
+    {"VariantId": 2, "RotationAngle": -2, "Contrast": 1.1, "Brightness": 0.0, "Saturation": 1.05, "Gamma": 1.02},
+    {"VariantId": 3, "RotationAngle": 3, "Contrast": 1.0, "Brightness": 0.03, "Saturation": 1.0, "Gamma": 0.98},
+    {"VariantId": 4, "RotationAngle": -3, "Contrast": 1.08, "Brightness": -0.01, "Saturation": 1.12, "Gamma": 1.0, "Mirror": True},
+    {"VariantId": 5, "RotationAngle": 1, "Contrast": 1.02, "Brightness": 0.01, "Saturation": 0.95, "Gamma": 1.01},
+]
+
+
+def generateVideo(folderName, width, height, duration, withAudio, fps=30):
+    # testsrc2 and sine are deterministic, the same arguments always give the same video
+    fileName = f"bench_{width}x{height}_{duration}s_{'audio' if withAudio else 'mute'}"
+    filePath = f"{folderName}/{fileName}.mp4"
+    if os.path.exists(filePath):
+        return fileName
+
+    ffmpegCommand = ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}"]
+    if withAudio:
+        ffmpegCommand.extend(["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}", "-c:a", "aac"])
+    ffmpegCommand.extend(["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", str(fps * 2), "-shortest", filePath])
+    subprocess.run(ffmpegCommand, check=True)
+    return fileName
+
+
+def readFrames(filePath, maxFrames):
+    cap = cv2.VideoCapture(filePath)
+    frames = []
+    while len(frames) < maxFrames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def benchmarkPixelFrames(folderName, fileName, engine, maxFrames):
+    frames = readFrames(f"{folderName}/{fileName}.mp4", maxFrames)
+    app.PIXEL_ENGINE = engine
+    frameHeight, frameWidth = frames[0].shape[:2]
+
+    startTime = time.perf_counter()
+    for index, frame in enumerate(frames):
+        app.deleteRandomPixelsInFrame(frame, frameHeight, frameWidth, index % 4 + 1)
+    return len(frames), time.perf_counter() - startTime
+
+
+def runStage(stage, folderName, fileName, options):
+    # Returns the number of frames the stage processed, and optionally the seconds to use instead of the wall time
+    # of the whole call when setup should not be measured
+    mediaInfo = app.probeMedia(f"{folderName}/{fileName}.mp4")
+    frameCount = int(round(mediaInfo.duration * mediaInfo.fps))
+
+    if stage == "pixelsNumpy":
+        return benchmarkPixelFrames(folderName, fileName, "numpy", options.pixelFrames)
+    if stage == "pixelsPython":
+        return benchmarkPixelFrames(folderName, fileName, "python", max(1, options.pixelFrames // 10))
+    if stage == "deleteRandomPixels":
+        app.deleteRandomPixels(folderName, fileName, 1)
+    elif stage == "swapVideoSides":
+        app.swapVideoSides(folderName, fileName)
+    elif stage == "processVideo":
+        app.processVideo(folderName, fileName, dict(benchmarkSpecs[0]))
+    elif stage == "processVideoVariants":
+        app.processVideoVariants(folderName, fileName, [dict(specs) for specs in benchmarkSpecs])
+        frameCount *= len(benchmarkSpecs)
+    elif stage == "splitVideo":
+        app.splitVideo(folderName, f"{fileName}.mp4", options.splitLength)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return frameCount, None
+
+
+def measureStage(stage, folderName, fileName, options, resultQueue):
+    # The report owns stdout, logs of the app and of the ffmpeg processes it starts go to stderr. Metrics would
+    # only time Redis lookups inside the measured region
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    app.METRICS_ENABLED = False
+    random.seed(options.seed)
+    np.random.seed(options.seed)
+    selfBefore = resource.getrusage(resource.RUSAGE_SELF)
+    childrenBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+    startTime = time.perf_counter()
+
+    result = {"stage": stage}
+    try:
+        frameCount, stageSeconds = runStage(stage, folderName, fileName, options)
+        wallSeconds = time.perf_counter() - startTime
+        selfAfter = resource.getrusage(resource.RUSAGE_SELF)
+        childrenAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        # ru_maxrss is in KiB on Linux, child usage covers the ffmpeg processes the stage started
+        cpuSeconds = (selfAfter.ru_utime - selfBefore.ru_utime) + (selfAfter.ru_stime - selfBefore.ru_stime)
+        cpuSeconds += (childrenAfter.ru_utime - childrenBefore.ru_utime) + (childrenAfter.ru_stime - childrenBefore.ru_stime)
+        measuredSeconds = stageSeconds if stageSeconds is not None else wallSeconds
+        result.update({
+            "frames": frameCount,
+            "wallSeconds": round(measuredSeconds, 4),
+            "cpuSeconds": round(cpuSeconds, 4),
+            "framesPerSecond": round(frameCount / measuredSeconds, 2) if measuredSeconds > 0 else None,
+            "peakRssBytes": selfAfter.ru_maxrss * 1024,
+            "peakChildRssBytes": childrenAfter.ru_maxrss * 1024,
+        })
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    resultQueue.put(result)
+
+
+def cleanFolder(folderName, keepFiles):
+    for fileName in os.listdir(folderName):
+        if fileName not in keepFiles:
+            app.removeFile(f"{folderName}/{fileName}")
+
+
+def getCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the video processing stages on generated test videos")
+    parser.add_argument("--resolutions", default="540x960,1080x1920", help="Comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--durations", default="5,20", help="Comma separated durations in seconds")
+    parser.add_argument("--audio", default="both", choices=["both", "with", "without"])
+    parser.add_argument("--stages", default="pixelsNumpy,pixelsPython,deleteRandomPixels,swapVideoSides,processVideo,processVideoVariants,splitVideo")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--pixelFrames", type=int, default=60, help="Frames timed by the per frame pixel stages")
+    parser.add_argument("--splitLength", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--folder", default="BenchmarkVideos")
+    parser.add_argument("--output", default="-", help="JSON output file, - for stdout")
+    options = parser.parse_args()
+
+    # stdout is kept for the report, the app's own logs go to stderr
+    with redirect_stdout(sys.stderr):
+        app.checkDir(options.folder)
+        audioOptions = {"both": [True, False], "with": [True], "without": [False]}[options.audio]
+
+        results = []
+        sourceFiles = set()
+        for resolution in options.resolutions.split(","):
+            width, height = (int(value) for value in resolution.split("x"))
+            for duration in (int(value) for value in options.durations.split(",")):
+                for withAudio in audioOptions:
+                    fileName = generateVideo(options.folder, width, height, duration, withAudio)
+                    sourceFiles.add(f"{fileName}.mp4")
+
+                    for stage in options.stages.split(","):
+                        for run in range(options.repeat):
+                            # Every run gets a fresh process so CPU time and peak RSS belong to that stage alone
+                            resultQueue = multiprocessing.Queue()
+                            process = multiprocessing.Process(target=measureStage, args=(stage, options.folder, fileName, options, resultQueue))
+                            process.start()
+                            result = resultQueue.get()
+                            process.join()
+                            result.update({"run": run, "video": {"width": width, "height": height, "duration": duration, "audio": withAudio}})
+                            results.append(result)
+                            print(json.dumps(result), file=sys.stderr)
+                            cleanFolder(options.folder, sourceFiles)
+
+    report = {
+        "commit": getCommit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"cpuCount": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+        "settings": {
+            "PIXEL_ENGINE": app.PIXEL_ENGINE,
+            "STREAM_FRAMES": app.STREAM_FRAMES,
+            "PIXEL_EFFECT_MODE": app.PIXEL_EFFECT_MODE,
+            "VARIANT_WORKERS": app.VARIANT_WORKERS,
+            "FFMPEG_THREADS": app.FFMPEG_THREADS,
+            "FRAME_WORKERS": app.FRAME_WORKERS,
+            "ENCODE_CHUNKS": app.ENCODE_CHUNKS,
+            "SPLIT_MODE": app.SPLIT_MODE,
+            "ffmpeg": shutil.which("ffmpeg"),
+        },
+        "results": results,
+    }
+    if options.output == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        with open(options.output, "w") as writer:
+            json.dump(report, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+import requests
+
+import app
+
+
+class FakeClock:
+    # Stands in for the time module inside app so backoff and rate limit waits are recorded instead of slept
+    def __init__(self, realSleep=False):
+        self.now = 1000.0
+        self.sleeps = []
+        self.realSleep = realSleep
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.realSleep:
+            time.sleep(seconds)
+
+
+class AirtableHandler(BaseHTTPRequestHandler):
+    # Answers with the scripted (status, headers) pairs in order, then with 200
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.received.append({"method": self.command, "path": self.path, "body": body})
+        status, headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+        content = json.dumps({"records": []}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def airtable(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AirtableHandler)
+    server.received = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    clock = FakeClock()
+    monkeypatch.setattr(app, "baseUrl", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(app, "AIRTABLE_BASE_ID", "appTest")
+    monkeypatch.setattr(app, "AIRTABLE_MAX_RETRIES", 3)
+    monkeypatch.setattr(app, "AIRTABLE_MAX_BACKOFF", 30)
+    monkeypatch.setattr(app, "airtableBuckets", {})
+    monkeypatch.setattr(app, "WORKER_CONCURRENCY", 1)
+    monkeypatch.setattr(app, "time", clock)
+    # Nothing listens on port 1, metrics are skipped and the rate limit falls back to the local bucket
+    monkeypatch.setattr(app, "redisClient", redis.Redis(port=1, retry=Retry(NoBackoff(), 0)))
+    server.clock = clock
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_retry_after_is_honoured(airtable):
+    airtable.responses = [(429, {"Retry-After": "7"})]
+    response = app.airtableRequest("GET", "tblTest")
+    assert response.status_code == 200
+    assert len(airtable.received) == 2
+    assert airtable.clock.sleeps[0] == 7
+
+
+def test_server_errors_back_off_exponentially(airtable, monkeypatch):
+    monkeypatch.setattr(app.random, "uniform", lambda low, high: high)
+    airtable.responses = [(500, {}), (502, {}), (503, {})]
+    response = app.airtableRequest("GET", "tblTest")
+    assert response.status_code == 200
+    assert len(airtable.received) == 4
+    assert airtable.clock.sleeps == [1, 2, 4]
+
+
+def test_final_failure_raises_http_error(airtable, monkeypatch):
+    monkeypatch.setattr(app.random, "uniform", lambda low, high: high)
+    airtable.responses = [(503, {})] * 4
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        app.airtableRequest("GET", "tblTest")
+    assert error.value.response.status_code == 503
+    assert len(airtable.received) == 4
+
+
+def test_update_records_patches_in_batches_of_ten(airtable):
+    records = [{"id": f"rec{index}", "fields": {"Processed": True}} for index in range(12)]
+    assert app.updateRecords(records, "tblTest")
+    assert [request["method"] for request in airtable.received] == ["PATCH", "PATCH"]
+    assert [len(request["body"]["records"]) for request in airtable.received] == [10, 2]
+    assert all(request["path"] == "/appTest/tblTest" for request in airtable.received)
+
+
+def test_failed_status_flush_keeps_updates(airtable, monkeypatch):
+    buffer = app.StatusUpdateBuffer("tblTest", 3600)
+    buffer.add("rec1", {"Processing In Progress": False})
+    # Nothing listens on port 1, the PATCH fails with a ConnectionError after its retries
+    serverUrl = app.baseUrl
+    monkeypatch.setattr(app, "baseUrl", "http://127.0.0.1:1")
+    buffer.flush()
+    assert buffer.pending == {"rec1": {"Processing In Progress": False}}
+
+    buffer.add("rec1", {"Video Processed": True})
+    monkeypatch.setattr(app, "baseUrl", serverUrl)
+    buffer.flush()
+    assert buffer.pending == {}
+    assert airtable.received[-1]["body"]["records"] == [{"id": "rec1", "fields": {"Processing In Progress": False, "Video Processed": True}}]
+
+
+def test_shared_rate_limit_spans_processes(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa") # Lua scripting in fakeredis
+    clock = FakeClock()
+    monkeypatch.setattr(app, "time", clock)
+    monkeypatch.setattr(app, "redisClient", fakeredis.FakeRedis())
+    # Two limiters stand for two processes, together they get the rate once
+    limiters = [app.SharedRateLimiter("airtable:appTest", 5), app.SharedRateLimiter("airtable:appTest", 5)]
+    for index in range(10):
+        limiters[index % 2].acquire()
+    assert sum(clock.sleeps) == pytest.approx(1)
+
+    clock.now += 1
+    limiters[0].pause(0.2)
+    clock.sleeps.clear()
+    limiters[1].acquire()
+    assert sum(clock.sleeps) == pytest.approx(0.2)
+
+
+def test_shared_rate_limit_has_no_window_boundary_burst(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    clock = FakeClock()
+    monkeypatch.setattr(app, "time", clock)
+    monkeypatch.setattr(app, "redisClient", fakeredis.FakeRedis())
+    limiter = app.SharedRateLimiter("airtable:appTest", 5)
+    # A full burst just before a second boundary, a fixed window would allow another one just after it
+    clock.now = 1000.99
+    for _ in range(5):
+        limiter.acquire()
+    clock.now = 1001.01
+    for _ in range(5):
+        limiter.acquire()
+    assert clock.sleeps
+    assert clock.now - 1000.99 >= 1 - 1e-6